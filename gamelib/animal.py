@@ -1,29 +1,23 @@
 """Class for the various animals in the game"""
 
-import random
-
 from pgu.vid import Sprite
 
 from . import imagecache
 from . import tiles
 from .misc import Position
-from . import sound
 from . import equipment
 from . import animations
 from . import serializer
 from . import constants
 
 
-NEIGHBOUR_4 = [Position(-1, 0), Position(1, 0), Position(0, 1), Position(0, -1)]
-
-
-NEIGHBOUR_8 = [Position(-1, 0), Position(1, 0), Position(0, 1), Position(0, -1),
-        Position(1, 1), Position(1, -1), Position(-1, 1), Position(-1, -1)]
-
-
 TILE_FENCE = tiles.REVERSE_TILE_MAP['fence']
 TILE_TRAP = tiles.REVERSE_TILE_MAP['trap']
 
+# (IMAGE_FILE, ((draw layer, equipment image), ...)) -> (left, right) images
+# Animals wearing the same kit share these, so they mustn't be drawn on.
+_composite_images = {}
+
 class Animal(Sprite, serializer.Simplifiable):
     """Base class for animals"""
 
@@ -50,8 +44,8 @@ class Animal(Sprite, serializer.Simplifiable):
         self._image_right = imagecache.load_image(self.IMAGE_FILE, ("right_facing",))
         # Create the animal somewhere far off screen
         Sprite.__init__(self, self._image_left, (-1000, -1000))
-        self.image_left = self._image_left.copy()
-        self.image_right = self._image_right.copy()
+        self.image_left = self._image_left
+        self.image_right = self._image_right
         if hasattr(tile_pos, 'to_tile_tuple'):
             self.pos = tile_pos
         else:
@@ -67,12 +61,9 @@ class Animal(Sprite, serializer.Simplifiable):
         """Override default Simplifiable object creation."""
         return cls((0, 0), None)
 
-    @classmethod
-    def unsimplify(cls, *args, **kwargs):
-        """Override default Simplifiable unsimplification."""
-        obj = super(Animal, cls).unsimplify(*args, **kwargs)
-        obj.redraw()
-        return obj
+    def restored(self):
+        """Override default Simplifiable restoration."""
+        self.redraw()
 
     def loop(self, tv, _sprite):
         ppos = tv.tile_to_view(self.pos.to_tile_tuple())
@@ -82,9 +73,9 @@ class Animal(Sprite, serializer.Simplifiable):
     def die(self):
         """Play death animation, noises, whatever."""
         if hasattr(self, 'DEATH_SOUND'):
-            sound.play_sound(self.DEATH_SOUND)
+            self.gameboard.play_sound(self.DEATH_SOUND)
         if hasattr(self, 'DEATH_ANIMATION'):
-            self.DEATH_ANIMATION(self.gameboard.tv, self.pos.to_tile_tuple())
+            self.gameboard.animate(self.DEATH_ANIMATION, self.pos.to_tile_tuple())
         self._game_death()
 
     def _game_death(self):
@@ -149,21 +140,31 @@ class Animal(Sprite, serializer.Simplifiable):
         return stealth
 
     def redraw(self):
-        layers = [(self._image_left.copy(), self._image_right.copy(), 0)]
+        # The animal itself is drawn as layer 0, before any equipment
+        # on the same layer
+        layers = [((0, ''), None)]
         if hasattr(self, 'EQUIPMENT_IMAGE_ATTRIBUTE'):
             for item in self.accoutrements + self.equipment:
-                images = item.images(self.EQUIPMENT_IMAGE_ATTRIBUTE)
-                if images:
-                    layers.append(images)
-
-        layers.sort(key=lambda l: l[2])
-
-        # these always go on the bottom so that other layers don't get overwritten
-        self.image_left = self._image_left.copy()
-        self.image_right = self._image_right.copy()
-        for l in layers:
-            self.image_left.blit(l[0], (0,0))
-            self.image_right.blit(l[1], (0,0))
+                eq_image_file = getattr(item, self.EQUIPMENT_IMAGE_ATTRIBUTE, None)
+                if eq_image_file:
+                    layers.append(((item.DRAW_LAYER, eq_image_file), item))
+
+        layers.sort(key=lambda l: l[0])
+
+        key = (self.IMAGE_FILE, tuple(l[0] for l in layers))
+        if key not in _composite_images:
+            # these always go on the bottom so that other layers don't get overwritten
+            image_left = self._image_left.copy()
+            image_right = self._image_right.copy()
+            for _layer, item in layers:
+                if item is None:
+                    left, right = self._image_left, self._image_right
+                else:
+                    left, right, _ = item.images(self.EQUIPMENT_IMAGE_ATTRIBUTE)
+                image_left.blit(left, (0,0))
+                image_right.blit(right, (0,0))
+            _composite_images[key] = (image_left, image_right)
+        self.image_left, self.image_right = _composite_images[key]
 
         self._set_image_facing(self.facing)
 
@@ -237,12 +238,19 @@ class Chicken(Animal):
     def _game_death(self):
         self.gameboard.remove_chicken(self)
 
+    def set_pos(self, tile_pos):
+        old_pos = self.pos
+        Animal.set_pos(self, tile_pos)
+        self.gameboard.chicken_moved(self, old_pos)
+
     def move(self):
         """A free chicken will wander around aimlessly"""
         pos_x, pos_y = self.pos.to_tile_tuple()
         surrounds = [Position(pos_x + dx, pos_y + dy) for dx in [-1, 0, 1] for dy in [-1, 0, 1]]
         pos_options = [pos for pos in surrounds if self.gameboard.in_bounds(pos) and self.gameboard.tv.get(pos.to_tile_tuple()) == self.gameboard.GRASSLAND and not self.gameboard.get_outside_chicken(pos.to_tile_tuple())] + [self.pos]
-        self.pos = pos_options[random.randint(0, len(pos_options)-1)]
+        old_pos = self.pos
+        self.pos = pos_options[self.gameboard.random.randint(0, len(pos_options)-1)]
+        self.gameboard.chicken_moved(self, old_pos)
 
     def has_axe(self):
         return bool([e for e in self.weapons() if e.TYPE == "AXE"])
@@ -253,8 +261,8 @@ class Chicken(Animal):
             surrounds = [Position(pos_x + dx, pos_y + dy) for dx in [-1, 0, 1] for dy in [-1, 0, 1]]
             tree_options = [pos for pos in surrounds if self.gameboard.in_bounds(pos) and self.gameboard.is_woodland_tile(pos)]
             if tree_options:
-                num_trees_to_cut = random.randint(1, len(tree_options))
-                trees_to_cut = random.sample(tree_options, num_trees_to_cut)
+                num_trees_to_cut = self.gameboard.random.randint(1, len(tree_options))
+                trees_to_cut = self.gameboard.random.sample(tree_options, num_trees_to_cut)
                 for tree_pos in trees_to_cut:
                     self.gameboard.add_wood(5)
                     self.gameboard.tv.set(tree_pos.to_tile_tuple(), self.gameboard.GRASSLAND)
@@ -274,8 +282,8 @@ class Chicken(Animal):
                         possible_eggs.append(StealthEgg)
                     elif equip.NAME == "Fox Disguise":
                         possible_eggs.append(FurryEgg)
-                for x in range(random.randint(1, 4)):
-                    new_egg_class = random.choice(possible_eggs)
+                for x in range(self.gameboard.random.randint(1, 4)):
+                    new_egg_class = self.gameboard.random.choice(possible_eggs)
                     new_egg = new_egg_class(self.pos, self.gameboard, fertilised=fertilised)
                     self.eggs.append(new_egg)
                 self.equip(equipment.NestEgg())
@@ -314,14 +322,13 @@ class Chicken(Animal):
     def _find_killable_fox(self, weapon):
         """Choose a random fox within range of this weapon."""
         killable_foxes = []
-        for fox in self.gameboard.foxes:
-            if not weapon.in_range(self.gameboard, self, fox):
-                continue
+        weapon_range = weapon.effective_range(self)
+        for fox in self.gameboard.foxes_near(self.pos, weapon_range):
             if visible(self, fox, self.gameboard):
                 killable_foxes.append(fox)
         if not killable_foxes:
             return None
-        return random.choice(killable_foxes)
+        return self.gameboard.random.choice(killable_foxes)
 
     def attack(self):
         """An armed chicken will attack a fox within range."""
@@ -366,7 +373,7 @@ class Rooster(Chicken):
         if self.abode and self.abode.building.NAME != 'Barracks':
             for rival in [occ for occ in self.abode.building.occupants()
                           if getattr(occ, 'ROOSTER', False)]:
-                if random.randint(1, 100) <= self.AGGRESSION:
+                if self.gameboard.random.randint(1, 100) <= self.AGGRESSION:
                     rival.damage()
 
 
@@ -401,7 +408,7 @@ class Egg(Animal):
     def hatch(self):
         self.timer -= 1
         if self.timer == 0 and self.fertilised:
-            return random.choice([Chicken, Rooster])(self.pos, self.gameboard)
+            return self.gameboard.random.choice([Chicken, Rooster])(self.pos, self.gameboard)
         return None
 
 class StealthEgg(Egg):
@@ -412,7 +419,7 @@ class StealthEgg(Egg):
     def hatch(self):
         self.timer -= 1
         if self.timer == 0 and self.fertilised:
-            return random.choice([StealthChicken, Rooster])(self.pos, self.gameboard)
+            return self.gameboard.random.choice([StealthChicken, Rooster])(self.pos, self.gameboard)
         return None
 
 class FurryEgg(Egg):
@@ -423,7 +430,7 @@ class FurryEgg(Egg):
     def hatch(self):
         self.timer -= 1
         if self.timer == 0 and self.fertilised:
-            return random.choice([Chicken, FurryRooster])(self.pos, self.gameboard)
+            return self.gameboard.random.choice([Chicken, FurryRooster])(self.pos, self.gameboard)
         return None
 
 class Enemy(Animal):
@@ -458,8 +465,6 @@ class Enemy(Animal):
         # Foxes don't occupy places in the same way chickens do, but they
         # can still be inside
         self.building = None
-        self._last_steps = []
-        self.path = []
 
     def outside(self):
         return self.building is None
@@ -468,12 +473,8 @@ class Enemy(Animal):
         self.gameboard.kill_fox(self)
 
     def _cost_tile(self, pos):
-        if self.gameboard.in_bounds(pos):
-            this_tile = self.gameboard.tv.get(pos.to_tile_tuple())
-            cost = self.costs.get(tiles.TILE_MAP[this_tile], 100)
-        else:
-            cost = 100 # Out of bounds is expensive
-        return cost
+        # Out of bounds is expensive
+        return self.gameboard.tile_cost(self.costs, pos)
 
     def _is_fence(self, pos):
         if self.gameboard.in_bounds(pos):
@@ -487,192 +488,30 @@ class Enemy(Animal):
             return this_tile == TILE_TRAP
         return False
 
-    def _check_steps(self, step, border_func, end_func, max_steps):
-        steps = 0
-        cur_pos = self.pos
-        path = []
-        while steps < max_steps:
-            if not border_func(cur_pos):
-                # Not walking the edge
-                return None
-            path.append(cur_pos)
-            if end_func(cur_pos):
-                # is there an 8-NEIGHBOUR that also satisfies end_func and is
-                # closer to target
-                dist = self.target.dist(cur_pos)
-                fin_pos = None
-                for pos in [cur_pos + x for x in NEIGHBOUR_8]:
-                    if pos in path:
-                        continue
-                    if end_func(pos) and self.target.dist(pos) < dist:
-                        fin_pos = pos
-                        dist = self.target.dist(pos)
-                if fin_pos:
-                    path.append(fin_pos)
-                return path
-            steps += 1
-            cur_pos = cur_pos + step
-        return None
-
-    def _search_for_path(self, border_func, end_func, max_steps):
-        paths = [None] * 4
-        paths[0] = self._check_steps(Position(-1, 0), border_func, end_func, max_steps)
-        paths[1] = self._check_steps(Position(0, -1), border_func, end_func, max_steps)
-        paths[2] = self._check_steps(Position(1, 0), border_func, end_func, max_steps)
-        paths[3] = self._check_steps(Position(0, 1), border_func, end_func, max_steps)
-        cands = [x for x in paths if x is not None]
-        if not cands:
-            return None
-        elif len(cands) == 1:
-            return cands[0][1:]
-        # take the end point closest to our target
-        final_path = cands[0]
-        min_dist = final_path[-1].dist(self.target)
-        for this_path in cands[1:]:
-            dist = this_path[-1].dist(self.target)
-            if dist < min_dist:
-                min_dist = dist
-                final_path = this_path
-            elif dist == min_dist and random.randint(0, 1) == 0:
-                final_path = this_path
-        return final_path[1:] # path's include self.pos
-
-    def _find_nearest_corner(self):
-        """Find the nearest corner of the building"""
-        COST_MARGIN = 25
-        def border(pos):
-            cost = self._cost_tile(pos)
-            if cost >= COST_MARGIN:
-                return False # in building isn't border
-            for tpos in [pos + step for step in NEIGHBOUR_8]:
-                if self.gameboard.in_bounds(tpos):
-                    cost = self._cost_tile(tpos)
-                    if cost >= COST_MARGIN:
-                        return True
-            return False
-
-        def corner(pos):
-            # A corner is not 4-connected to a building
-            if not border(pos):
-                return False
-            for tpos in [pos + step for step in NEIGHBOUR_4]:
-                if self.gameboard.in_bounds(tpos):
-                    cost = self._cost_tile(tpos)
-                    if cost >= COST_MARGIN:
-                        return False
-            return True
-
-        return self._search_for_path(border, corner, 6)
-
-    def _find_fence_gap(self):
-        # We search for a gap in the fence
-        # we know we are next to fence. A gap in the fence is
-        # a point that borders the fence where the fence is not
-        # 4-connected
-
-        COST_MARGIN = 25
-
-        def border(pos):
-            if self._is_fence(pos) or self._cost_tile(pos) >= COST_MARGIN:
-                return False
-            for tpos in [pos + step for step in NEIGHBOUR_8]:
-                if self._is_fence(tpos) or self._cost_tile(tpos) >= COST_MARGIN:
-                    return True
-            return False
-
-        def is_gap(pos):
-            # A gap neighbours only fence tiles which has < 2 4-neighbours
-            if self._is_fence(pos):
-                return False
-            fence_neighbours = [0]
-            for tpos in [pos + step for step in NEIGHBOUR_8]:
-                if self._is_fence(tpos):
-                    connections = 0
-                    for fpos in [tpos + step for step in NEIGHBOUR_4]:
-                        if self.gameboard.in_bounds(fpos):
-                            if self._is_fence(fpos) or self._cost_tile(tpos) >= COST_MARGIN:
-                                # Expensive building is considered fence
-                                connections += 1
-                        else:
-                            # Fence connecting to out of bounds counts as fence
-                            connections += 1
-                    fence_neighbours.append(connections)
-            return max(fence_neighbours) < 2
-
-        return self._search_for_path(border, is_gap, 7)
-
-    def _find_min_cost_neighbour(self, target):
-        """Find the minimum cost neighbour that's closer to target"""
-        cur_dist = target.dist(self.pos)
-        neighbours = [self.pos + step for step in NEIGHBOUR_8]
-        min_cost = 1000
-        min_dist = cur_dist
-        best = self.pos
-        for point in neighbours:
-            if point in self._last_steps:
-                continue
-            dist = point.dist(target)
-            if dist <= min_dist:
-                cost = self._cost_tile(point)
-                if cost < min_cost or (min_cost == cost and dist < min_dist):
-                    # Prefer closest of equal cost points
-                    min_dist = dist
-                    min_cost = cost
-                    best = point
-                elif min_cost == cost and random.randint(0, 1) == 0:
-                    # Be slightly non-deterministic when presented with
-                    # equal choices
-                    best = point
-        return best, min_cost
-
     def _find_best_path_step(self):
-        """Find the cheapest path to final_pos, and return the next step
+        """Find the cheapest path to the target, and return the next step
            along the path."""
-        if self.path:
-            next_step = self.path.pop(0)
-            if next_step.dist(self.pos) < 2:
-                return next_step
-            else:
-                # Been bounced off the path
-                self.path = []
-        new_pos = None
         if self.target.z < self.pos.z:
             # We need to try heading down.
-            new_pos = Position(self.pos.x, self.pos.y, self.pos.z - 1)
+            return Position(self.pos.x, self.pos.y, self.pos.z - 1)
         if self.target.x == self.pos.x and self.target.y == self.pos.y and \
                 self.target.z > self.pos.z:
             # We try heading up
-            new_pos = Position(self.pos.x, self.pos.y, self.pos.z + 1)
-        if new_pos:
-            if new_pos in self._last_steps:
-                # ladder, so we allow backtracking
-                self._last_steps.remove(new_pos)
-            return new_pos
+            return Position(self.pos.x, self.pos.y, self.pos.z + 1)
         cur_dist = self.target.dist(self.pos)
         if cur_dist < 2:
             # We're right ontop of our target, so just go there
             return self.target
-        # Find the cheapest spot close to us that moves us closer to the target
-        best, min_cost = self._find_min_cost_neighbour(self.target)
-        if min_cost < 20 or not self.gameboard.in_bounds(self.pos) \
-                or not self.gameboard.in_bounds(best):
-            # If we're not on the gameboard yet, there's no point in looking
-            # for an optimal path.
-            return best
-        # Else expensive step, so think further
-        if self._is_fence(best):
-            path = self._find_fence_gap()
-        elif min_cost == 30:
-            # building
-            path = self._find_nearest_corner()
-        else:
-            # We're looping
-            self._last_steps = []
+        # Once we're done hunting, any way off the board will do
+        steps = self.gameboard.path_steps(self.costs, self.pos, self.target,
+                not self.hunting)
+        if not steps:
             return self.pos
-        if path:
-            self.path = path[1:] # exclude 1st step
-            return path[0]
-        return best
+        if len(steps) > 1:
+            # Be slightly non-deterministic when presented with
+            # equal choices
+            return self.gameboard.random.choice(steps)
+        return steps[0]
 
     def _calc_next_move(self):
         """Find the path to the target"""
@@ -680,7 +519,7 @@ class Enemy(Animal):
             # Check if we need to update our idea of a target
             if self.closest and self.closest in self.gameboard.chickens:
                 stealth = self.closest.get_stealth()
-                roll = random.randint(1, 100)
+                roll = self.gameboard.random.randint(1, 100)
                 is_visible = roll > stealth
                 if not is_visible:
                     self._select_prey()
@@ -691,7 +530,6 @@ class Enemy(Animal):
                 self._select_prey()
         if not self.target:
             self.target = self.start_pos
-            self._last_steps = []
         if self.target == self.pos:
             # No need to move, but we will need to update the target
             self.target = None
@@ -722,7 +560,7 @@ class Enemy(Animal):
             dist = self._calculate_dist(chicken)
             if dist < min_dist:
                 stealth = chicken.get_stealth()
-                roll = random.randint(1, 100)
+                roll = self.gameboard.random.randint(1, 100)
                 # if we're reselecting prey, the previous_chicken is hidden
                 is_visible = (chicken is not previous_chicken) and (roll > stealth)
                 if is_visible:
@@ -748,7 +586,6 @@ class Enemy(Animal):
         self.closest = None
         self.hunting = False
         self.target = self.start_pos
-        self._last_steps = []
 
     def _update_pos(self, new_pos):
         """Update the position, making sure we don't step on other foxes"""
@@ -766,7 +603,7 @@ class Enemy(Animal):
                 moves = [Position(self.pos.x, self.pos.y, z) for z
                         in range(self.pos.z-1, self.pos.z + 2) if z >= 0]
             else:
-                moves = [self.pos + step for step in NEIGHBOUR_8]
+                moves = self.pos.neighbours()
             # find the cheapest point in moves that's not blocked
             final_pos = None
             min_cost = 1000
@@ -777,7 +614,7 @@ class Enemy(Animal):
                 if cost < min_cost:
                     min_cost = cost
                     final_pos = poss
-                if cost == min_cost and random.randint(0, 1) > 0:
+                if cost == min_cost and self.gameboard.random.randint(0, 1) > 0:
                     # Add some randomness in this case
                     final_pos = poss
         if not final_pos:
@@ -785,9 +622,6 @@ class Enemy(Animal):
             return self.pos
         if self._is_fence(final_pos) and not self.dig_pos:
             return self._dig(final_pos)
-        self._last_steps.append(final_pos)
-        if len(self._last_steps) > 6:
-            self._last_steps.pop(0)
         return final_pos
 
     def _dig(self, dig_pos):
@@ -884,7 +718,7 @@ class SapperFox(Fox):
         """Setup dig parameters, to be overridden if needed"""
         self.tick = 0 # Costs us nothing to go through a fence.
         self.dig_pos = dig_pos
-        self.DIG_ANIMATION(self.gameboard.tv, dig_pos.to_tile_tuple())
+        self.gameboard.animate(self.DIG_ANIMATION, dig_pos.to_tile_tuple())
         self._make_hole()
         return self.pos
 
@@ -906,7 +740,6 @@ class GreedyFox(Fox):
         if self.chickens_eaten > 2:
             self.hunting = False
             self.target = self.start_pos
-            self._last_steps = []
         else:
             self._select_prey() # select new target
 
@@ -941,7 +774,7 @@ class RobberFox(Fox):
     def _catch_chicken(self, chicken):
         """Catch a chicken"""
         if chicken.equipment:
-            e = random.choice(chicken.equipment)
+            e = self.gameboard.random.choice(chicken.equipment)
             chicken.unequip(e)
             self.equip(e)
             self.hungry = True
@@ -953,7 +786,6 @@ class RobberFox(Fox):
         if self.chickens_robbed > 2:
             self.hunting = False
             self.target = self.start_pos
-            self._last_steps = []
         else:
             self._select_prey() # select new target
 
@@ -985,7 +817,6 @@ class EggEater(Enemy):
         self.closest = None
         self.hunting = False
         self.target = self.start_pos
-        self._last_steps = []
 
 class Rinkhals(EggEater):
     """The Rinkhals has eclectic tastes"""
@@ -1037,16 +868,14 @@ def visible(watcher, watchee, gameboard):
     vision_bonus = _get_vision_param('VISION_BONUS', watcher)
     training_bonus = getattr(watcher, 'TRAINING', 0)*8
     range_penalty = _get_vision_param('VISION_RANGE_PENALTY', watcher)
-    positions = watcher.pos.intermediate_positions(watchee.pos)
-    for pos in positions:
-        building = gameboard.get_building(pos.to_tile_tuple())
+    blockers, woods = gameboard.line_of_sight(watcher.pos, watchee.pos)
+    for building in blockers:
         # This allows chickens to fire across WatchTowers and Fences.
-        if building and building.BLOCKS_VISION and not (watcher in building.occupants()):
+        if not (watcher in building.occupants()):
             return False
     distance = watcher.pos.dist(watchee.pos) - 1
-    # Intervening forests get in the way a bit.
-    woods = len([pos for pos in positions if gameboard.is_woodland_tile(pos)])
-    roll = random.randint(training_bonus + 1, 100)
+    # Intervening forests (woods) get in the way a bit.
+    roll = gameboard.random.randint(training_bonus + 1, 100)
     return roll > watchee.get_stealth() - vision_bonus + range_penalty*distance + constants.WOODLAND_CONCEALMENT*woods
 
 # These don't have to add up to 100, but it's easier to think
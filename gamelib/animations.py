@@ -20,21 +20,23 @@ class Animation(Sprite):
         self.iter = iter(sequence)
         self.layer = layer
         Sprite.__init__(self, next(self.iter), tv.tile_to_view(tile_pos))
-        tv.sprites.append(self, layer=self.layer)
+        # Animations belong with whatever sprites are being drawn
+        self.sprites = tv.drawn_sprites
+        self.sprites.append(self, layer=self.layer)
 
     def loop(self, tv, s):
         """Step to the next frame, removing sprite when done."""
         try:
             self.setimage(next(self.iter))
         except StopIteration:
-            tv.sprites.remove(self, layer=self.layer)
+            self.sprites.remove(self, layer=self.layer)
 
 class WeaponAnimation(Animation):
-    def __init__(self, tv, wielder, layer='animations'):
-        if wielder.facing == 'right':
-            Animation.__init__(self, tv, wielder.pos.to_tile_tuple(), self.SEQUENCE_RIGHT, layer=layer)
+    def __init__(self, tv, tile_pos, facing, layer='animations'):
+        if facing == 'right':
+            Animation.__init__(self, tv, tile_pos, self.SEQUENCE_RIGHT, layer=layer)
         else:
-            Animation.__init__(self, tv, wielder.pos.to_tile_tuple(), self.SEQUENCE_LEFT, layer=layer)
+            Animation.__init__(self, tv, tile_pos, self.SEQUENCE_LEFT, layer=layer)
 
 
 class MuzzleFlash(WeaponAnimation):
@@ -3,17 +3,21 @@
 from pgu.vid import Sprite
 from pygame.locals import SRCALPHA
 import pygame
-import random
 
 from . import imagecache
-from . import sound
+from . import fontcache
 from . import tiles
 from . import constants
 from . import serializer
 
-# ignore os.popen3 warning generated by pygame.font.SysFont
-import warnings
-warnings.filterwarnings("ignore", "os.popen3 is deprecated.")
+# font used for the occupant counts
+COUNT_FONT = ('Vera', 30, True)
+
+# (image size, count, selected count, predator count) -> count overlay
+_count_images = {}
+
+# tuple of draw stack images, bottom first -> composed building image
+_composed_images = {}
 
 class Place(serializer.Simplifiable):
     """Space within a building that can be occupied."""
@@ -84,6 +88,7 @@ class Building(Sprite, serializer.Simplifiable):
     FLOORS = None
     HENHOUSE = False
     BLOCKS_VISION = True
+    TILE_ONLY = False
 
     SIMPLIFY = [
         'pos',
@@ -109,9 +114,6 @@ class Building(Sprite, serializer.Simplifiable):
         self._sell_price = self.SELL_PRICE
         self._repair_price = getattr(self, 'REPAIR_PRICE', None)
         self._sun_on = True
-        self._font = pygame.font.SysFont('Vera', 30, bold=True)
-        self._font_image = pygame.Surface(self.images['fixed']['day'].get_size(), flags=SRCALPHA)
-        self._font_image.fill((0, 0, 0, 0))
         self._broken = False
         self._predators = []
 
@@ -139,13 +141,10 @@ class Building(Sprite, serializer.Simplifiable):
         """Override default Simplifiable object creation."""
         return cls((0, 0), None)
 
-    @classmethod
-    def unsimplify(cls, *args, **kwargs):
-        """Override default Simplifiable unsimplification."""
-        obj = super(Building, cls).unsimplify(*args, **kwargs)
-        obj._set_main_image()
-        obj.update_occupant_count()
-        return obj
+    def restored(self):
+        """Override default Simplifiable restoration."""
+        self._set_main_image()
+        self.update_occupant_count()
 
     def _set_images(self):
         self.images = {'fixed': {
@@ -167,9 +166,20 @@ class Building(Sprite, serializer.Simplifiable):
     def _redraw(self):
         items = list(self.draw_stack.values())
         items.sort(key=lambda x: x[0])
-        image = items.pop(0)[1].copy()
-        for _lvl, overlay in items:
-            image.blit(overlay, (0, 0))
+        # The images in the draw stack all come from shared caches, so the
+        # same stack always composes to the same image. Keeping those means
+        # switching between day and night, or selecting a building, just
+        # picks out an image we've drawn before.
+        key = tuple(overlay for _lvl, overlay in items)
+        image = _composed_images.get(key)
+        if image is None:
+            if len(key) == 1:
+                image = key[0]
+            else:
+                image = key[0].copy()
+                for overlay in key[1:]:
+                    image.blit(overlay, (0, 0))
+            _composed_images[key] = image
         self.setimage(image)
 
     def _replace_main(self, new_main):
@@ -286,33 +296,45 @@ class Building(Sprite, serializer.Simplifiable):
             if "count" in self.draw_stack:
                 del self.draw_stack["count"]
         else:
-            # Render chicken count
-            image = self._font_image.copy()
-            w, h = image.get_size()
+            sel_count = 0
             if count:
-                text = self._font.render(str(count), True,
-                        constants.FG_COLOR)
-                # Blit to the right
-                x, y = text.get_size()
-                image.blit(text, (w - x, h - y))
                 sel_count = len([chick for chick in self.occupants()
                     if chick in self.gameboard.selected_chickens])
-                if sel_count:
-                    text = self._font.render(str(sel_count), True,
-                            constants.SELECTED_COUNT_COLOR)
-                    x, y = text.get_size()
-                    image.blit(text, (0, h - y))
-            # Render predator count
-            if self._predators:
-                text = self._font.render(str(len(self._predators)), True,
-                        constants.PREDATOR_COUNT_COLOR)
-                # Blit to the left
-                x, y = text.get_size()
-                image.blit(text, (0, h - y))
-            self.draw_stack["count"] = (1, image)
+            size = self.images['fixed']['day'].get_size()
+            key = (size, count, sel_count, len(self._predators))
+            if key not in _count_images:
+                _count_images[key] = self._render_counts(size, count,
+                        sel_count, len(self._predators))
+            self.draw_stack["count"] = (1, _count_images[key])
 
         self._redraw()
 
+    def _render_counts(self, size, count, sel_count, predator_count):
+        """Render the occupant counts onto a transparent overlay."""
+        image = pygame.Surface(size, flags=SRCALPHA)
+        image.fill((0, 0, 0, 0))
+        w, h = size
+        # Render chicken count
+        if count:
+            text = fontcache.render(str(count), constants.FG_COLOR,
+                    *COUNT_FONT)
+            # Blit to the right
+            x, y = text.get_size()
+            image.blit(text, (w - x, h - y))
+            if sel_count:
+                text = fontcache.render(str(sel_count),
+                        constants.SELECTED_COUNT_COLOR, *COUNT_FONT)
+                x, y = text.get_size()
+                image.blit(text, (0, h - y))
+        # Render predator count
+        if predator_count:
+            text = fontcache.render(str(predator_count),
+                    constants.PREDATOR_COUNT_COLOR, *COUNT_FONT)
+            # Blit to the left
+            x, y = text.get_size()
+            image.blit(text, (0, h - y))
+        return image
+
     def floors(self):
         return self._floors
 
@@ -410,7 +432,78 @@ class Barracks(Abode):
     NAME = 'Barracks'
     FLOORS = [1, 2, 3]
 
-class Fence(Building):
+class TileStructure(object):
+    """Base class for small structures that live entirely in the tile layer.
+
+       There can be a lot of these, so they're kept small: they're drawn
+       as tiles rather than sprites, have no floors or occupants, and
+       whether they're broken is read off the tile itself. The gameboard
+       keeps them in a table by tile position.
+       """
+
+    IS_BUILDING = True
+    GRASSLAND = tiles.REVERSE_TILE_MAP['grassland']
+    BREAKABLE = False
+    ABODE = False
+    FLOORS = None
+    HENHOUSE = False
+    BLOCKS_VISION = True
+    TILE_ONLY = True
+    SIZE = (1, 1)
+
+    __slots__ = ['pos', 'gameboard']
+
+    def __init__(self, pos, gameboard):
+        self.pos = tuple(pos)
+        self.gameboard = gameboard
+
+    def tile_positions(self):
+        yield self.pos
+
+    def covers(self, tile_pos):
+        """Return True if build covers tile_pos, False otherwise."""
+        return self.pos == (tile_pos[0], tile_pos[1])
+
+    def place(self):
+        """Check that the structure can be placed at its current position
+           and place it if possible.
+           """
+        if not self.gameboard.tv.get(self.pos) == self.GRASSLAND:
+            return False
+        self.gameboard.tv.set(self.pos, self.TILE_NO)
+        return True
+
+    def remove(self):
+        """Remove the structure from its current position."""
+        self.gameboard.tv.set(self.pos, self.GRASSLAND)
+
+    def broken(self):
+        return self.BREAKABLE and \
+                self.gameboard.tv.get(self.pos) == self.TILE_NO_BROKEN
+
+    def damage(self):
+        if not self.BREAKABLE:
+            return False
+        self.gameboard.tv.set(self.pos, self.TILE_NO_BROKEN)
+
+    def repair(self):
+        self.gameboard.tv.set(self.pos, self.TILE_NO)
+
+    def buy_price(self):
+        return self.BUY_PRICE
+
+    def sell_price(self):
+        if self.broken():
+            return self.SELL_PRICE_BROKEN
+        return self.SELL_PRICE
+
+    def repair_price(self):
+        return getattr(self, 'REPAIR_PRICE', None)
+
+    def occupants(self):
+        return iter([])
+
+class Fence(TileStructure):
     """A fence."""
 
     TILE_NO = tiles.REVERSE_TILE_MAP['fence']
@@ -420,25 +513,19 @@ class Fence(Building):
     SELL_PRICE = 3
     REPAIR_PRICE = 2
     SELL_PRICE_BROKEN = 1
-    SIZE = (1, 1)
     IMAGE = 'tiles/fence.png'
-    SELECTED_IMAGE = 'tiles/fence.png'
-    IMAGE_BROKEN = 'tiles/broken_fence.png'
-    SELECTED_IMAGE_BROKEN = 'tiles/broken_fence.png'
     NAME = 'Fence'
 
     BLOCKS_VISION = False
 
-class Trap(Building):
+class Trap(TileStructure):
     """A trap."""
 
     TILE_NO = tiles.REVERSE_TILE_MAP['trap']
 
     BUY_PRICE = 12
     SELL_PRICE = 6
-    SIZE = (1, 1)
     IMAGE = 'tiles/trap.png'
-    SELECTED_IMAGE = 'tiles/trap.png'
     NAME = 'Trap'
 
     BLOCKS_VISION = False
@@ -447,8 +534,8 @@ class Trap(Building):
     def catch(self, target):
         """Is the potentially unlucky target actually unlucky?"""
         if hasattr(self, 'TRAP_SOUND'):
-            sound.play_sound(self.TRAP_SOUND)
-        roll = random.randint(1, 100)
+            self.gameboard.play_sound(self.TRAP_SOUND)
+        roll = self.gameboard.random.randint(1, 100)
         base_catch = getattr(self, 'BASE_CATCH')
         return roll > (100-base_catch)
 
@@ -464,3 +551,7 @@ for name in dir():
             BUILDINGS.append(obj)
     except TypeError:
         pass
+
+# class name -> class, for the structures stored in the tile layer
+TILE_STRUCTURES = dict((cls.__name__, cls) for cls in BUILDINGS
+        if cls.TILE_ONLY)
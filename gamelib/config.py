@@ -11,6 +11,7 @@ class Config(object):
     valid_options = {
         'sound': {'type': 'boolean', 'default': 'true'},
         'level_name': {'type': 'string', 'default': 'two_weeks'},
+        'replay_nights': {'type': 'boolean', 'default': 'true'},
         }
 
     def configure(self, params=None):
@@ -41,6 +42,10 @@ class Config(object):
                           help="enable sound")
         parser.add_option("--no-sound", action="store_const", const="off", dest="sound",
                           help="disable sound")
+        parser.add_option("--replay", action="store_const", const="on", dest="replay_nights",
+                          help="replay resolved nights")
+        parser.add_option("--no-replay", action="store_const", const="off", dest="replay_nights",
+                          help="go straight to the next day after resolving a night")
         (self._opts, _) = parser.parse_args(params or [])
         self.prefs_folder = self._opts.prefs_folder or self._default_prefs_dir()
         self.ensure_dir_exists(self.prefs_folder)
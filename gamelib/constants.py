@@ -20,6 +20,7 @@ AUTHORS = [
 SCREEN = (1300, 920)
 TILE_DIMENSIONS = (28, 28)
 TOOLBAR_WIDTH = 180
+FPS = 50 # target frame rate for the main loop
 
 FG_COLOR = (255, 255, 255)
 PREDATOR_COUNT_COLOR = (255, 100, 0) # Approximately fox coloured
@@ -70,8 +71,7 @@ GO_MAIN_MENU = pygame.event.Event(USEREVENT, name="GO_MAIN_MENU")
 GO_HELP_SCREEN = pygame.event.Event(USEREVENT, name="GO_HELP_SCREEN")
 GO_GAME_OVER = pygame.event.Event(USEREVENT, name="GO_GAME_OVER")
 FAST_FORWARD = pygame.event.Event(USEREVENT, name="FAST_FORWARD")
-MOVE_FOX_ID = USEREVENT + 11
-MOVE_FOXES = pygame.event.Event(MOVE_FOX_ID, name="MOVE_FOXES")
+RESOLVE_NIGHT = pygame.event.Event(USEREVENT, name="RESOLVE_NIGHT")
 DO_LOAD_SAVEGAME = USEREVENT + 12
 DO_LOAD_LEVEL = USEREVENT + 13
 DO_QUIT = pygame.event.Event(QUIT)
@@ -10,6 +10,9 @@ from . import constants
 from . import mainmenu
 from . import helpscreen
 from . import level
+from . import scheduler
+from . import nightlog
+from .config import config
 
 class Engine(Game):
     def __init__(self, main_app, level_name):
@@ -18,10 +21,11 @@ class Engine(Game):
         self.level = level.Level(level_name)
         self._open_window = None
         self.gameboard = None
+        self.scheduler = scheduler.FrameScheduler(constants.FPS)
 
     def tick(self):
         """Tic toc."""
-        pygame.time.wait(10)
+        self.scheduler.tick()
 
     def load_new_level(self, new_level):
         self.level = new_level
@@ -127,8 +131,6 @@ class DayState(State):
         self.game.gameboard.start_day()
 
         sound.play_sound("daybreak.ogg")
-        # disable timer
-        pygame.time.set_timer(constants.MOVE_FOX_ID, 0)
         sound.background_music("daytime.ogg")
 
     def event(self, e):
@@ -165,54 +167,112 @@ class NightState(State):
 
         sound.play_sound("nightfall.ogg")
 
-        # Add a timer to the event queue
         self.cycle_count = 0
-        self.cycle_time = SLOW__SPEED
-        pygame.time.set_timer(constants.MOVE_FOX_ID, self.cycle_time)
+        self.dawn = False
+        self.speed = SLOW__SPEED
+        self.stepper = scheduler.FixedStep(SLOW__SPEED)
+        self.replay = None
+        # The night runs on a worker thread, and we draw snapshots of it
+        self.view = nightlog.SnapshotView(self.game.gameboard)
+        self.view.show([nightlog.take_snapshot(self.game.gameboard)])
+        self.worker = nightlog.NightWorker(self.game.gameboard)
         sound.background_music("nighttime.ogg")
 
         self.dialog = None
 
     def event(self, e):
         if events_equal(e, constants.START_DAY):
+            self.stop_worker()
             if self.game.gameboard.level.is_game_over(self.game.gameboard):
                 return GameOver(self.game)
             return DayState(self.game)
         elif events_equal(e, constants.GO_GAME_OVER):
+            self.stop_worker()
             return GameOver(self.game)
         elif events_equal(e, constants.FAST_FORWARD):
-            if self.cycle_time > FAST__SPEED:
-                self.cycle_time = FAST__SPEED
-            else:
-                self.cycle_time = SLOW__SPEED
-            pygame.time.set_timer(constants.MOVE_FOX_ID, self.cycle_time)
+            # Slow -> fast -> turbo -> slow
+            old_speed = self.speed
+            self.speed = SPEEDS[(SPEEDS.index(self.speed) + 1) % len(SPEEDS)]
+            if self.speed != TURBO__SPEED:
+                self.stepper.set_step_time(self.speed)
+                if old_speed == TURBO__SPEED:
+                    # The stepper sat idle through turbo
+                    self.stepper.reset()
             return
-        elif e.type == constants.MOVE_FOX_ID:
-            # ensure no timers trigger while we're running
-            pygame.time.set_timer(constants.MOVE_FOX_ID, 0)
-            cur_time = pygame.time.get_ticks()
-            # Clear any queued timer events, so we don't fill the queue
-            pygame.event.clear(constants.MOVE_FOX_ID)
-            # Ensure any outstanding animitions get cleaned up
-            self.cycle_count += 1
-            if self.cycle_count > constants.NIGHT_LENGTH:
-                pygame.event.post(constants.START_DAY)
-                return
-            if self.game.gameboard.do_night_step():
-                # All foxes are gone/safe, so dawn happens
-                pygame.event.post(constants.START_DAY)
-                return
-            # Re-enable timers
-            diff = pygame.time.get_ticks() - cur_time
-            time_left = self.cycle_time - diff
-            if time_left <= 0:
-                time_left = self.cycle_time
-            pygame.time.set_timer(constants.MOVE_FOX_ID, time_left)
+        elif events_equal(e, constants.RESOLVE_NIGHT):
+            if self.replay is not None:
+                self.end_replay()
+            elif not self.dawn:
+                self.resolve_night()
             return
 
-        self.game.main_app.event(e)
+        if self.worker is None:
+            self.game.main_app.event(e)
+        else:
+            # Wait for any step the worker's on to finish with the board
+            with self.worker.lock:
+                self.game.main_app.event(e)
+
+    def stop_worker(self):
+        """Stop running night steps, and draw the board itself again.
+           Returns the number of night steps taken."""
+        if self.worker is None:
+            return self.cycle_count
+        self.worker.stop()
+        self.cycle_count = self.worker.steps_taken
+        self.worker = None
+        self.view.finish()
+        return self.cycle_count
+
+    def resolve_night(self):
+        """Run the rest of the night at once, then replay it quickly."""
+        steps_taken = self.stop_worker()
+        log = None
+        if config.replay_nights:
+            log = nightlog.NightLog()
+        self.cycle_count = nightlog.resolve_night(self.game.gameboard,
+                steps_taken, log)
+        self.dawn = True
+        if log is None:
+            pygame.event.post(constants.START_DAY)
+        else:
+            self.replay = nightlog.NightReplay(self.game.gameboard, log)
+
+    def end_replay(self):
+        self.replay.finish()
+        self.replay = None
+        pygame.event.post(constants.START_DAY)
+
+    def request_steps(self):
+        """Ask the worker for the night steps that are due."""
+        if self.speed == TURBO__SPEED:
+            # Keep the worker going flat out
+            while self.worker.pending() < TURBO_QUEUE:
+                self.worker.request_step()
+        else:
+            # Ask for any steps we've fallen behind on, but not so many
+            # that a slow step leaves a long backlog
+            for _step in self.stepper.steps():
+                if self.worker.pending() >= scheduler.MAX_CATCH_UP:
+                    break
+                self.worker.request_step()
 
     def loop(self):
+        if self.replay is not None:
+            # One recorded step a frame
+            if not self.replay.show_next():
+                self.end_replay()
+        elif self.worker is not None:
+            self.request_steps()
+            # Draw the newest snapshot, whether or not the worker has
+            # finished the steps we asked for
+            steps = self.worker.take_steps()
+            if steps:
+                self.view.show(steps)
+            if self.worker.dawn and not self.dawn:
+                # Out of time, or all foxes are gone/safe, so dawn happens
+                self.dawn = True
+                pygame.event.post(constants.START_DAY)
         self.game.gameboard.loop()
 
     def paint(self, screen):
@@ -229,7 +289,6 @@ class GameOver(State):
         """Setup everything"""
         sound.stop_background_music()
         self.game.create_game_over()
-        pygame.time.set_timer(constants.MOVE_FOX_ID, 0)
 
     def event(self, e):
         if e.type == KEYDOWN:
@@ -255,7 +314,11 @@ def events_equal(e1, e2):
     """Compare two user events."""
     return (e1.type == e2.type and e1.name == e2.name)
 
-# Due to the way pgu's loop timing works, these will only get proceesed
-# at intervals of 10ms, so there's no point in them not being multiples of 10
+# Milliseconds per night step. Turbo runs steps as fast as it can.
+TURBO__SPEED=0
 FAST__SPEED=80
 SLOW__SPEED=200
+SPEEDS = [SLOW__SPEED, FAST__SPEED, TURBO__SPEED]
+# Night steps kept queued for the worker in turbo, so it never waits on
+# the next frame to carry on
+TURBO_QUEUE = 2
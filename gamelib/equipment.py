@@ -1,12 +1,14 @@
 """Stuff for animals to use."""
 
-import random
-from . import sound
 from . import imagecache
 from . import animations
 from . import serializer
 
 
+# (class, image attribute, image file) -> (left, right) finished images
+_equipment_images = {}
+
+
 class Equipment(serializer.Simplifiable):
     IS_EQUIPMENT = True
     DRAW_LAYER = 0
@@ -45,10 +47,22 @@ class Equipment(serializer.Simplifiable):
         eq_image_file = getattr(self, eq_image_attr, None)
         if not eq_image_file:
             return None
+        key = (self.__class__, eq_image_attr, eq_image_file)
+        if key not in _equipment_images:
+            _equipment_images[key] = self._compose_images(eq_image_attr,
+                    eq_image_file)
+        eq_image_left, eq_image_right = _equipment_images[key]
+        return eq_image_left, eq_image_right, self.DRAW_LAYER
+
+    def _compose_images(self, eq_image_attr, eq_image_file):
+        """Build the left and right images for this kind of equipment."""
         eq_image_left = imagecache.load_image(eq_image_file)
         eq_image_right = imagecache.load_image(eq_image_file, ("right_facing",))
-        if eq_image_attr == "ANIMAL_IMAGE_FILE":
+        if eq_image_attr == "ANIMAL_IMAGE_FILE" and (self.UNDER_LIMB or self.UNDER_EYE):
             # a bit hacky; eventually the chicken should have a stack of images and layering should take care of everything
+            # copy, since the image cache's surfaces are shared
+            eq_image_left = eq_image_left.copy()
+            eq_image_right = eq_image_right.copy()
             if self.UNDER_LIMB:
                 wing_left = imagecache.load_image("sprites/wing.png")
                 wing_right = imagecache.load_image("sprites/wing.png", ("right_facing",))
@@ -59,7 +73,7 @@ class Equipment(serializer.Simplifiable):
                 eye_right = imagecache.load_image("sprites/eye.png", ("right_facing",))
                 eq_image_left.blit(eye_left, (0,0))
                 eq_image_right.blit(eye_right, (0,0))
-        return eq_image_left, eq_image_right, self.DRAW_LAYER
+        return eq_image_left, eq_image_right
 
     def refresh_ammo(self):
         self.ammunition = getattr(self, 'AMMUNITION', None)
@@ -78,9 +92,13 @@ class Weapon(Equipment):
             param = modifier(param)
         return param
 
+    def effective_range(self, wielder):
+        """The range of this weapon in the hands (wings?) of wielder."""
+        return self._get_parameter('RANGE', wielder)
+
     def in_range(self, gameboard, wielder, target):
         """Can the lucky wielder hit the potentially unlucky target with this?"""
-        return wielder.pos.dist(target.pos) <= self._get_parameter('RANGE', wielder)
+        return wielder.pos.dist(target.pos) <= self.effective_range(wielder)
 
     def hit(self, gameboard, wielder, target):
         """Is the potentially unlucky target actually unlucky?"""
@@ -91,11 +109,12 @@ class Weapon(Equipment):
             else:
                 self.ammunition -= 1
         if hasattr(self, 'HIT_SOUND'):
-            sound.play_sound(self.HIT_SOUND)
+            gameboard.play_sound(self.HIT_SOUND)
         if hasattr(self, 'ANIMATION'):
-            self.ANIMATION(gameboard.tv, wielder)
+            gameboard.animate(self.ANIMATION, wielder.pos.to_tile_tuple(),
+                    wielder.facing)
         training_bonus = getattr(wielder, 'TRAINING', 0)*10
-        roll = random.randint(training_bonus + 1, 100)
+        roll = gameboard.random.randint(training_bonus + 1, 100)
         base_hit = self._get_parameter('BASE_HIT', wielder)
         range_penalty = self._get_parameter('RANGE_PENALTY', wielder)
         return roll > (100-base_hit) + range_penalty*wielder.pos.dist(target.pos)
@@ -109,19 +128,19 @@ class Weapon(Equipment):
             else:
                 self.ammunition -= 1
         if hasattr(self, 'HIT_SOUND'):
-            sound.play_sound(self.HIT_SOUND)
+            gameboard.play_sound(self.HIT_SOUND)
         if hasattr(self, 'ANIMATION'):
-            self.ANIMATION(gameboard.tv, wielder)
+            gameboard.animate(self.ANIMATION, wielder.pos.to_tile_tuple(),
+                    wielder.facing)
         base_hit = self._get_parameter('BASE_HIT', wielder)
         range_penalty = self._get_parameter('RANGE_PENALTY', wielder)
         training_bonus = getattr(wielder, 'TRAINING', 0)*10
-        roll = random.randint(training_bonus + 1, 100)
-        damaged_foxes = set()
-        for fox in gameboard.foxes:
-            if target_pos.dist(fox.pos) <= self.DAMAGE_RANGE:
-                damage_penalty = self.DAMAGE_RANGE_PENALTY * fox.pos.dist(target_pos)
-                if roll > (100-base_hit) + range_penalty*(wielder.pos.dist(target_pos) + damage_penalty):
-                    damaged_foxes.add(fox)
+        roll = gameboard.random.randint(training_bonus + 1, 100)
+        damaged_foxes = []
+        for fox in gameboard.foxes_near(target_pos, self.DAMAGE_RANGE):
+            damage_penalty = self.DAMAGE_RANGE_PENALTY * fox.pos.dist(target_pos)
+            if roll > (100-base_hit) + range_penalty*(wielder.pos.dist(target_pos) + damage_penalty):
+                damaged_foxes.append(fox)
         for fox in damaged_foxes:
             fox.damage()
 
@@ -0,0 +1,42 @@
+"""Central font cache to avoid looking up fonts and rendering the same
+   text over and over."""
+
+import pygame
+
+# ignore os.popen3 warning generated by pygame.font.SysFont
+import warnings
+warnings.filterwarnings("ignore", "os.popen3 is deprecated.")
+
+class FontCache(object):
+    """Cache of system fonts, and of text rendered in them."""
+
+    def __init__(self):
+        # (name, size, bold) -> pygame font
+        self._fonts = {}
+        # (name, size, bold, text, colour) -> pygame surface
+        self._text = {}
+
+    def get_font(self, name, size, bold=False):
+        """Look up a system font, or return the cached font."""
+        key = (name, size, bold)
+        if key not in self._fonts:
+            self._fonts[key] = pygame.font.SysFont(name, size, bold=bold)
+        return self._fonts[key]
+
+    def render(self, text, colour, name, size, bold=False):
+        """Render antialiased text, or return the cached rendering.
+
+           The surface returned is shared, so copy it before drawing on it.
+           """
+        colour = tuple(colour)
+        key = (name, size, bold, text, colour)
+        if key not in self._text:
+            font = self.get_font(name, size, bold)
+            self._text[key] = font.render(text, True, colour)
+        return self._text[key]
+
+# globals
+
+cache = FontCache()
+get_font = cache.get_font
+render = cache.render
@@ -3,7 +3,7 @@ import random
 import pygame
 from pygame.locals import MOUSEBUTTONDOWN, MOUSEBUTTONUP, MOUSEMOTION, KEYDOWN, K_UP, K_DOWN, \
         K_LEFT, K_RIGHT, KMOD_SHIFT, K_0, K_1, K_2, K_3, K_4, K_5, K_6, K_7, \
-        K_8, K_9, K_ESCAPE, K_n, K_d, KMOD_CTRL, KMOD_ALT, KEYUP
+        K_8, K_9, K_ESCAPE, K_n, K_d, K_r, KMOD_CTRL, KMOD_ALT, KEYUP
 from pgu import gui
 
 from . import tiles
@@ -19,6 +19,7 @@ from . import misc
 from . import toolbar
 from . import serializer
 from . import savegame
+from . import pathfinding
 
 class VidWidget(gui.Widget):
     def __init__(self, gameboard, vid, **params):
@@ -76,6 +77,162 @@ class AnimalPositionCache(object):
         return self._cache[animal_type].get(pos, None)
 
 
+class OutsideChickenCache(object):
+    """Map from tile position to the outside chicken standing on it."""
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._cache = {}
+
+    def add(self, chicken):
+        if chicken.outside():
+            self._cache[chicken.pos.to_tile_tuple()] = chicken
+
+    def remove(self, pos, chicken):
+        tile_pos = pos.to_tile_tuple()
+        if self._cache.get(tile_pos) is chicken:
+            del self._cache[tile_pos]
+
+    def update(self, old_pos, chicken):
+        self.remove(old_pos, chicken)
+        self.add(chicken)
+
+    def get(self, tile_pos):
+        return self._cache.get((tile_pos[0], tile_pos[1]), None)
+
+
+class FoxSpatialHash(object):
+    """Foxes bucketed by position on a coarse grid, for range queries."""
+
+    BUCKET_SIZE = 4
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._buckets = {}
+        # fox -> (order added, bucket key)
+        self._foxes = {}
+        self._next_order = 0
+
+    def _key(self, pos):
+        return pos.x // self.BUCKET_SIZE, pos.y // self.BUCKET_SIZE
+
+    def add(self, fox):
+        key = self._key(fox.pos)
+        self._foxes[fox] = (self._next_order, key)
+        self._next_order += 1
+        self._buckets.setdefault(key, {})[fox] = None
+
+    def remove(self, fox):
+        if fox in self._foxes:
+            _order, key = self._foxes.pop(fox)
+            del self._buckets[key][fox]
+
+    def update(self, fox):
+        if fox not in self._foxes:
+            return
+        order, old_key = self._foxes[fox]
+        key = self._key(fox.pos)
+        if key != old_key:
+            del self._buckets[old_key][fox]
+            self._buckets.setdefault(key, {})[fox] = None
+            self._foxes[fox] = (order, key)
+
+    def near(self, pos, radius):
+        """Return the foxes within radius of pos, in the order they
+           were added."""
+        size = self.BUCKET_SIZE
+        found = []
+        for bx in range((pos.x - radius) // size, (pos.x + radius) // size + 1):
+            for by in range((pos.y - radius) // size, (pos.y + radius) // size + 1):
+                bucket = self._buckets.get((bx, by))
+                if bucket:
+                    found.extend(fox for fox in bucket
+                            if fox.pos.dist(pos) <= radius)
+        found.sort(key=lambda fox: self._foxes[fox][0])
+        return found
+
+
+class BuildingPositionCache(object):
+    """Map from tile position to the building covering it."""
+
+    def __init__(self, gameboard):
+        self.gameboard = gameboard
+        self.clear()
+
+    def clear(self):
+        self._cache = {}
+
+    def add(self, building):
+        for tile_pos in building.tile_positions():
+            # Where buildings overlap, the first one added wins
+            self._cache.setdefault(tile_pos, building)
+
+    def remove(self, building):
+        freed = []
+        for tile_pos in building.tile_positions():
+            if self._cache.get(tile_pos) is building:
+                del self._cache[tile_pos]
+                freed.append(tile_pos)
+        # Uncover anything that was overlapped by the removed building
+        for tile_pos in freed:
+            for other in self.gameboard.buildings:
+                if other is not building and other.covers(tile_pos):
+                    self._cache[tile_pos] = other
+                    break
+
+    def get(self, tile_pos):
+        return self._cache.get((tile_pos[0], tile_pos[1]), None)
+
+
+class LineOfSightCache(object):
+    """Cache of what lies along the line of sight between two tiles.
+
+       Each ray is stored as the vision blocking buildings along it and the
+       number of woodland tiles it crosses. Rays are forgotten when any
+       tile along them changes.
+       """
+
+    def __init__(self, gameboard):
+        self.gameboard = gameboard
+        self.clear()
+
+    def clear(self):
+        # (start tile, end tile) -> (blocking buildings, woodland count)
+        self._rays = {}
+        # tile -> keys of the rays passing through it
+        self._rays_through = {}
+
+    def get(self, start, end):
+        key = (start.to_tile_tuple(), end.to_tile_tuple())
+        ray = self._rays.get(key)
+        if ray is None:
+            ray = self._trace(key, start.intermediate_positions(end))
+        return ray
+
+    def _trace(self, key, positions):
+        blockers = []
+        woods = 0
+        for pos in positions:
+            tile_pos = pos.to_tile_tuple()
+            self._rays_through.setdefault(tile_pos, set()).add(key)
+            building = self.gameboard.get_building(tile_pos)
+            if building and building.BLOCKS_VISION and building not in blockers:
+                blockers.append(building)
+            if self.gameboard.is_woodland_tile(pos):
+                woods += 1
+        ray = (blockers, woods)
+        self._rays[key] = ray
+        return ray
+
+    def tile_changed(self, tile_pos, _old_tile, _new_tile):
+        for key in self._rays_through.pop(tuple(tile_pos), ()):
+            self._rays.pop(key, None)
+
+
 class GameBoard(serializer.Simplifiable):
 
     GRASSLAND = tiles.REVERSE_TILE_MAP['grassland']
@@ -93,6 +250,7 @@ class GameBoard(serializer.Simplifiable):
         'chickens',
         'foxes',
         'buildings',
+        'tile_structure_table',
         #'_pos_cache',
         'cash',
         'wood',
@@ -100,14 +258,31 @@ class GameBoard(serializer.Simplifiable):
         'days',
         'killed_foxes',
         'day', 'night',
+        'seed',
+        'random_state',
     ]
 
-    def __init__(self, main_app, level):
+    # Seeds are saved as xmlrpc ints, which are only 32 bits wide
+    MAX_SEED = 2**31 - 1
+
+    def __init__(self, main_app, level, seed=None):
         self.disp = main_app
         self.level = level
+        # Every random decision on this board is drawn from its own stream,
+        # so that a game can be replayed from its seed
+        if seed is None:
+            seed = random.randint(0, self.MAX_SEED)
+        self.seed = seed
+        self.random = random.Random(seed)
         self.tv = tiles.FarmVid()
         self.tv.png_folder_load_tiles('tiles')
-        self.tv.tga_load_level(level.map)
+        self.tv.tga_load_level(level.map, self.random)
+        self._los_cache = LineOfSightCache(self)
+        self.tv.add_tile_listener(self._los_cache.tile_changed)
+        self._cost_grids = {}
+        self._flow_fields = pathfinding.FlowFields(self)
+        self.tv.add_tile_listener(self._flow_fields.tile_changed)
+        self.tv.add_tile_listener(self._tile_changed)
         width, height = self.tv.size
         # Ensure we don't every try to create more foxes then is sane
         self.max_foxes = level.max_foxes
@@ -117,22 +292,38 @@ class GameBoard(serializer.Simplifiable):
         self.sprite_cursor = None
         self.selected_chickens = []
         self.stored_selections = {}
-        self.chickens = set()
-        self.foxes = set()
-        self.buildings = set()
+        # These are dicts used as insertion ordered sets, so that animals
+        # act (and draw random numbers) in the same order on every replay
+        self.chickens = {}
+        self.foxes = {}
+        self.buildings = {}
+        # tile position -> fence, trap or other structure living in the
+        # tile layer rather than buildings
+        self.tile_structures = {}
         self._pos_cache = AnimalPositionCache(self)
+        self._chicken_cache = OutsideChickenCache()
+        self._fox_hash = FoxSpatialHash()
+        self._building_cache = BuildingPositionCache(self)
         self.cash = 0
         self.wood = 0
         self.eggs = 0
         self.days = 0
         self.killed_foxes = 0
         self.day, self.night = True, False
-        # For the level loading case
+        self.toolbar = None
+        # Animations and sounds are turned off to resolve a night quickly
+        self.show_effects = True
+        # NightLog recording the night's animations, if any
+        self.night_log = None
+        # animations and sounds started since the last frame
+        self._frame_effects = set()
+        # set while a night step runs without touching the display
+        self._headless_step = False
+        # No display for the level loading case or headless simulations
         if self.disp:
-            self.toolbar = None
             self.create_display()
-            self.add_cash(level.starting_cash)
-            self.add_wood(level.starting_wood)
+        self.add_cash(level.starting_cash)
+        self.add_wood(level.starting_wood)
 
         self.fix_buildings()
 
@@ -142,38 +333,50 @@ class GameBoard(serializer.Simplifiable):
 
         self.tv.run_codes(cdata, (0,0,width,height))
 
-    @classmethod
-    def unsimplify(cls, *args, **kwargs):
-        """Override default Simplifiable unsimplification."""
-        obj = super(GameBoard, cls).unsimplify(*args, **kwargs)
-
-        obj.tv.png_folder_load_tiles('tiles')
-        obj.calculate_wood_groat_exchange_rate()
-
-        obj._pos_cache = AnimalPositionCache(obj)
-        obj._cache_animal_positions()
+    def restored(self):
+        """Override default Simplifiable restoration."""
+        self.tv.png_folder_load_tiles('tiles')
+        self.calculate_wood_groat_exchange_rate()
+        self._los_cache = LineOfSightCache(self)
+        self.tv.add_tile_listener(self._los_cache.tile_changed)
+        self._cost_grids = {}
+        self._flow_fields = pathfinding.FlowFields(self)
+        self.tv.add_tile_listener(self._flow_fields.tile_changed)
+        self.tv.add_tile_listener(self._tile_changed)
 
-        obj.sprite_cursor = None
-        obj.set_selected_tool(None, None)
+        self._pos_cache = AnimalPositionCache(self)
+        self._cache_animal_positions()
+        self.show_effects = True
+        self.night_log = None
+        self._frame_effects = set()
+        self._headless_step = False
 
-        obj.disp = None
+        self.sprite_cursor = None
+        self.disp = None
+        self.toolbar = None
+        self.set_selected_tool(None, None)
 
         # put chickens, foxes and buildings into sprite list
 
-        existing_chickens = obj.chickens
-        obj.chickens = set()
+        existing_chickens = self.chickens
+        self.chickens = {}
+        self._chicken_cache = OutsideChickenCache()
         for chicken in existing_chickens:
-            obj.add_chicken(chicken)
+            self.add_chicken(chicken)
 
-        existing_foxes = obj.foxes
-        obj.foxes = set()
+        existing_foxes = self.foxes
+        self.foxes = {}
+        self._fox_hash = FoxSpatialHash()
         for fox in existing_foxes:
-            obj.add_fox(fox)
+            self.add_fox(fox)
 
-        existing_buildings = obj.buildings
-        obj.buildings = set()
+        existing_buildings = self.buildings
+        self.buildings = {}
+        self._building_cache = BuildingPositionCache(self)
         for building in existing_buildings:
-            obj.add_building(building)
+            self.add_building(building)
+        for structure in self.tile_structures.values():
+            self._building_cache.add(structure)
 
         # self.disp is not set properly here
         # whoever unsimplifies the gameboard needs to arrange for it to be
@@ -182,7 +385,37 @@ class GameBoard(serializer.Simplifiable):
         #  - .tvw
         #  - .top_widget
 
-        return obj
+    def _get_random_state(self):
+        version, internal, gauss_next = self.random.getstate()
+        return [version] + list(internal)
+
+    def _set_random_state(self, state):
+        if isinstance(state, str):
+            # older save games store the numbers as a string
+            numbers = [int(x) for x in state.split()]
+        else:
+            numbers = state
+        self.random = random.Random()
+        self.random.setstate((numbers[0], tuple(numbers[1:]), None))
+
+    # The state words don't fit in xmlrpc ints, but the serializer packs
+    # lists of ints, so that doesn't matter
+    random_state = property(_get_random_state, _set_random_state)
+
+    def _get_tile_structure_table(self):
+        return [[structure.__class__.__name__, x, y]
+                for (x, y), structure in self.tile_structures.items()]
+
+    def _set_tile_structure_table(self, table):
+        self.tile_structures = {}
+        for name, x, y in table:
+            structure_cls = buildings.TILE_STRUCTURES[name]
+            self.tile_structures[(x, y)] = structure_cls((x, y), self)
+
+    # Whether a structure is broken is saved in the tile layer, so only
+    # their kinds and positions need saving
+    tile_structure_table = property(_get_tile_structure_table,
+            _set_tile_structure_table)
 
     def get_top_widget(self):
         return self.top_widget
@@ -243,6 +476,7 @@ class GameBoard(serializer.Simplifiable):
 
     def loop(self):
         self.tv.loop()
+        self._frame_effects = set()
 
     def set_selected_tool(self, tool, cursor):
         if not self.day:
@@ -254,7 +488,10 @@ class GameBoard(serializer.Simplifiable):
             return False # Using the tool on selected chickens is immediate
         self.selected_tool = tool
         sprite_curs = None
-        if buildings.is_building(tool):
+        if not self.disp:
+            # Headless boards have no cursors to show
+            pass
+        elif buildings.is_building(tool):
             sprite_curs = sprite_cursor.SpriteCursor(tool.IMAGE, self.tv, tool.BUY_PRICE)
         elif equipment.is_equipment(tool):
             sprite_curs = sprite_cursor.SpriteCursor(tool.ANIMAL_IMAGE_FILE, self.tv)
@@ -267,6 +504,8 @@ class GameBoard(serializer.Simplifiable):
     def set_tool_cursor(self, current_cursor=None):
         if current_cursor:
             self.current_cursor = current_cursor
+        if not self.disp:
+            return
         if pygame.mouse.get_pos()[0] >= constants.TOOLBAR_WIDTH:
             self.set_cursor(*self.current_cursor)
 
@@ -292,6 +531,8 @@ class GameBoard(serializer.Simplifiable):
         return False
 
     def set_cursor(self, cursor=None, sprite_curs=None):
+        if not self.disp:
+            return
         if cursor:
             pygame.mouse.set_cursor(*cursor)
         else:
@@ -305,7 +546,8 @@ class GameBoard(serializer.Simplifiable):
     def reset_states(self):
         """Clear current states (highlights, etc.)"""
         self.set_selected_tool(None, None)
-        self.toolbar.clear_tool()
+        if self.disp:
+            self.toolbar.clear_tool()
 
     def update_sprite_cursor(self, e):
         tile_pos = self.tv.screen_to_tile(e.pos)
@@ -319,12 +561,15 @@ class GameBoard(serializer.Simplifiable):
         self.current_cursor = (cursors.cursors['arrow'],)
         self.set_menu_cursor()
         self.unselect_all()
-        self.toolbar.start_night()
+        if self.disp:
+            self.toolbar.start_night()
+        self._flow_fields.clear()
         self.spawn_foxes()
         self.eggs = 0
         for chicken in self.chickens.copy():
             chicken.start_night()
-        self.toolbar.update_egg_counter(self.eggs)
+        if self.disp:
+            self.toolbar.update_egg_counter(self.eggs)
         self._cache_animal_positions()
         self.chickens_chop_wood()
         self.chickens_scatter()
@@ -336,13 +581,15 @@ class GameBoard(serializer.Simplifiable):
         self.day, self.night = True, False
         self.tv.sun(True)
         self.reset_states()
-        self.toolbar.start_day()
+        if self.disp:
+            self.toolbar.start_day()
         self._pos_cache.clear()
         self.advance_day()
         self.clear_foxes()
         for chicken in self.chickens.copy():
             chicken.start_day()
-        self.redraw_counters()
+        if self.disp:
+            self.redraw_counters()
 
     def skip_next_start_day(self):
         # used to skip the start of the day triggered after
@@ -412,16 +659,15 @@ class GameBoard(serializer.Simplifiable):
                 self.buy_equipment(self.tv.screen_to_tile(e.pos), self.selected_tool)
 
     def get_outside_chicken(self, tile_pos):
-        for chick in self.chickens:
-            if chick.covers(tile_pos) and chick.outside():
-                return chick
-        return None
+        return self._chicken_cache.get(tile_pos)
+
+    def chicken_moved(self, chicken, old_pos):
+        """Called by chickens whenever their position changes."""
+        if chicken in self.chickens:
+            self._chicken_cache.update(old_pos, chicken)
 
     def get_building(self, tile_pos):
-        for building in self.buildings:
-            if building.covers(tile_pos):
-                return building
-        return None
+        return self._building_cache.get(tile_pos)
 
     def sell_chicken(self, tile_pos):
 
@@ -472,7 +718,8 @@ class GameBoard(serializer.Simplifiable):
 
     def remove_eggs(self, num):
         self.eggs -= num
-        self.toolbar.update_egg_counter(self.eggs)
+        if self.disp:
+            self.toolbar.update_egg_counter(self.eggs)
 
     def sell_egg(self, tile_pos):
         def do_sell(chicken, update_button=None):
@@ -480,7 +727,8 @@ class GameBoard(serializer.Simplifiable):
             if self.sell_one_egg(chicken):
                 sound.play_sound("sell-chicken.ogg")
                 # Force toolbar update
-                self.toolbar.chsize()
+                if self.disp:
+                    self.toolbar.chsize()
                 if update_button:
                     update_button(chicken)
             return False
@@ -796,7 +1044,8 @@ class GameBoard(serializer.Simplifiable):
         building = building_cls(tile_pos, self)
         if self.wood < building.buy_price():
             return
-        if any(building.covers((chicken.pos.x, chicken.pos.y)) for chicken in self.chickens):
+        if any(self.get_outside_chicken(tile_pos)
+                for tile_pos in building.tile_positions()):
             return
         if building.place():
             self.add_wood(-building.buy_price())
@@ -905,6 +1154,9 @@ class GameBoard(serializer.Simplifiable):
         elif e.type == KEYDOWN and e.key == K_d and self.night:
             pygame.event.post(constants.FAST_FORWARD)
             return True
+        elif e.type == KEYDOWN and e.key == K_r and self.night:
+            pygame.event.post(constants.RESOLVE_NIGHT)
+            return True
         elif e.type == KEYDOWN and e.key in [K_UP, K_DOWN, K_LEFT, K_RIGHT]:
             if e.key == K_UP:
                 self.tvw.move_view(0, -constants.TILE_DIMENSIONS[1])
@@ -959,7 +1211,8 @@ class GameBoard(serializer.Simplifiable):
                 self.kill_fox(fox)
             else:
                 self.remove_fox(fox)
-        self.foxes = set() # Remove all the foxes
+        self.foxes = {} # Remove all the foxes
+        self._fox_hash.clear()
 
     def clear_chickens(self):
         for chicken in self.chickens.copy():
@@ -968,21 +1221,55 @@ class GameBoard(serializer.Simplifiable):
     def clear_buildings(self):
         for building in self.buildings.copy():
             self.remove_building(building)
+        for structure in list(self.tile_structures.values()):
+            self.remove_building(structure)
 
-    def do_night_step(self):
+    def do_night_step(self, headless=False):
         """Handle the events of the night.
 
            We return True if there are no more foxes to move or all the
-           foxes are safely back. This end's the night"""
+           foxes are safely back. This end's the night
+
+           If headless is set, the step leaves the toolbar alone and
+           doesn't start any animations or sounds, so it can be run away
+           from the main thread."""
         if not self.foxes:
             return True
-        # Move all the foxes
-        over = self.foxes_move()
-        if not over:
-            self.foxes_attack()
-            self.chickens_attack()
+        self._headless_step = headless
+        try:
+            # Move all the foxes
+            over = self.foxes_move()
+            if not over:
+                self.foxes_attack()
+                self.chickens_attack()
+        finally:
+            self._headless_step = False
         return over
 
+    def animate(self, animation, *args):
+        """Start an animation on the board, if we're showing them, and
+           note it in the night log.
+
+           When several night steps run in a frame, the same animation
+           in the same place is only started once.
+           """
+        if self.night_log is not None:
+            self.night_log.animation(animation, args)
+        if (self.show_effects and not self._headless_step
+                and (animation, args) not in self._frame_effects):
+            self._frame_effects.add((animation, args))
+            animation(self.tv, *args)
+
+    def play_sound(self, filename):
+        """Play a sound, if we're showing effects and haven't already
+           played it this frame, and note it in the night log."""
+        if self.night_log is not None:
+            self.night_log.sound(filename)
+        if (self.show_effects and not self._headless_step
+                and filename not in self._frame_effects):
+            self._frame_effects.add(filename)
+            sound.play_sound(filename)
+
     def _cache_animal_positions(self):
         """Cache the current set of fox positions for the avoiding checks"""
         self._pos_cache.clear()
@@ -994,6 +1281,37 @@ class GameBoard(serializer.Simplifiable):
     def get_animal_at_pos(self, pos, animal_type):
         return self._pos_cache.get(pos, animal_type)
 
+    def cost_grid(self, costs):
+        """Return the MovementCostGrid for the given costs table."""
+        # Costs tables are class attributes, so live as long as we do
+        grid = self._cost_grids.get(id(costs))
+        if grid is None:
+            grid = self._cost_grids[id(costs)] = \
+                    pathfinding.MovementCostGrid(self.tv, costs)
+            self.tv.add_tile_listener(grid.tile_changed)
+        return grid
+
+    def tile_cost(self, costs, pos):
+        """Return the cost of moving onto pos for an animal using the
+           given costs table."""
+        return self.cost_grid(costs).get(pos.to_tile_tuple())
+
+    def path_steps(self, costs, pos, target, to_edge=False):
+        """Return the neighbours of pos on the cheapest paths to target.
+
+           If to_edge is set, heading for any tile off the same edge of the
+           board as target is good enough."""
+        return self._flow_fields.next_step(costs, pos, target, to_edge)
+
+    def line_of_sight(self, start, end):
+        """Return the vision blocking buildings between start and end,
+           and the number of woodland tiles in the way."""
+        return self._los_cache.get(start, end)
+
+    def foxes_near(self, pos, radius):
+        """Return the foxes within radius of pos."""
+        return self._fox_hash.near(pos, radius)
+
     def chickens_scatter(self):
         """Chickens outside move around randomly a bit"""
         for chicken in [chick for chick in self.chickens if chick.outside()]:
@@ -1005,16 +1323,17 @@ class GameBoard(serializer.Simplifiable):
         """Chickens with axes chop down trees near them"""
         for chicken in [chick for chick in self.chickens if chick.outside()]:
             chicken.chop()
-        self.calculate_wood_groat_exchange_rate()
 
     def foxes_move(self):
         over = True
+        self._flow_fields.start_step()
         for fox in self.foxes.copy():
             old_pos = fox.pos
             fox.move()
             if not fox.safe:
                 over = False
                 self._pos_cache.update(old_pos, fox, 'fox')
+                self._fox_hash.update(fox)
             else:
                 # Avoid stale fox on board edge
                 self.remove_fox(fox)
@@ -1028,20 +1347,30 @@ class GameBoard(serializer.Simplifiable):
         for chicken in self.chickens:
             chicken.attack()
 
+    def _toolbar_shown(self):
+        """True if the toolbar counters should be kept up to date."""
+        return bool(self.disp) and not self._headless_step
+
     def add_chicken(self, chicken):
-        self.chickens.add(chicken)
+        self.chickens[chicken] = None
+        self._chicken_cache.add(chicken)
         if chicken.outside():
             self.tv.sprites.append(chicken)
-        if self.disp:
+        if self._toolbar_shown():
             self.toolbar.update_chicken_counter(len(self.chickens))
 
     def add_fox(self, fox):
-        self.foxes.add(fox)
+        self.foxes[fox] = None
+        self._fox_hash.add(fox)
         self.tv.sprites.append(fox)
 
     def add_building(self, building):
-        self.buildings.add(building)
-        self.tv.sprites.append(building, layer='buildings')
+        if building.TILE_ONLY:
+            self.tile_structures[building.pos] = building
+        else:
+            self.buildings[building] = None
+            self.tv.sprites.append(building, layer='buildings')
+        self._building_cache.add(building)
 
     def place_hatched_chicken(self, new_chick, building):
         try:
@@ -1064,13 +1393,15 @@ class GameBoard(serializer.Simplifiable):
 
     def kill_fox(self, fox):
         self.killed_foxes += 1
-        self.toolbar.update_fox_counter(self.killed_foxes)
+        if self._toolbar_shown():
+            self.toolbar.update_fox_counter(self.killed_foxes)
         self.add_cash(self.level.sell_price_dead_fox)
         self.remove_fox(fox)
 
     def remove_fox(self, fox):
         self._pos_cache.remove(fox.pos, 'fox')
-        self.foxes.discard(fox)
+        self.foxes.pop(fox, None)
+        self._fox_hash.remove(fox)
         if fox.building:
             fox.building.remove_predator(fox)
         if fox in self.tv.sprites:
@@ -1079,32 +1410,41 @@ class GameBoard(serializer.Simplifiable):
     def remove_chicken(self, chick):
         if chick in self.selected_chickens:
             self.unselect_animal(chick)
-        self.chickens.discard(chick)
+        self.chickens.pop(chick, None)
+        self._chicken_cache.remove(chick.pos, chick)
         self.eggs -= chick.get_num_eggs()
-        self.toolbar.update_egg_counter(self.eggs)
         if chick.abode:
             chick.abode.clear_occupant()
-        self.toolbar.update_chicken_counter(len(self.chickens))
+        if self._toolbar_shown():
+            self.toolbar.update_egg_counter(self.eggs)
+            self.toolbar.update_chicken_counter(len(self.chickens))
         if chick in self.tv.sprites and chick.outside():
             self.tv.sprites.remove(chick)
         self._pos_cache.remove(chick.pos, 'chicken')
 
     def remove_building(self, building):
-        if building in self.buildings:
-            self.buildings.discard(building)
+        if building.TILE_ONLY:
+            if self.tile_structures.get(building.pos) is building:
+                del self.tile_structures[building.pos]
+                self._building_cache.remove(building)
+        elif building in self.buildings:
+            del self.buildings[building]
+            self._building_cache.remove(building)
             self.tv.sprites.remove(building, layer='buildings')
 
     def add_cash(self, amount):
         self.cash += amount
-        self.toolbar.update_cash_counter(self.cash)
+        if self._toolbar_shown():
+            self.toolbar.update_cash_counter(self.cash)
 
     def add_wood(self, planks):
         self.wood += planks
-        self.toolbar.update_wood_counter(self.wood)
+        if self._toolbar_shown():
+            self.toolbar.update_wood_counter(self.wood)
 
     def add_start_chickens(self, _map, tile, value):
         """Add chickens as specified by the code layer"""
-        chick = random.choice([animal.Chicken, animal.Rooster])((tile.tx, tile.ty), self)
+        chick = self.random.choice([animal.Chicken, animal.Rooster])((tile.tx, tile.ty), self)
         for equip_cls in equipment.EQUIP_MAP[value]:
             item = equip_cls()
             chick.equip(item)
@@ -1112,7 +1452,7 @@ class GameBoard(serializer.Simplifiable):
 
     def _choose_fox(self, coords):
         (x, y) = coords
-        fox_cls = misc.WeightedSelection(self.level.fox_weightings).choose()
+        fox_cls = misc.WeightedSelection(self.level.fox_weightings).choose(self.random)
         return fox_cls((x, y), self)
 
     def spawn_foxes(self):
@@ -1121,24 +1461,24 @@ class GameBoard(serializer.Simplifiable):
         x, y = 0, 0
         width, height = self.tv.size
         min_foxes = max(self.level.min_foxes, (self.days+3)//2) # always more than one fox
-        new_foxes = min(random.randint(min_foxes, min_foxes*2), self.max_foxes)
+        new_foxes = min(self.random.randint(min_foxes, min_foxes*2), self.max_foxes)
         while len(self.foxes) < new_foxes:
-            side = random.randint(0, 3)
+            side = self.random.randint(0, 3)
             if side == 0:
                 # top
                 y = -1
-                x = random.randint(-1, width)
+                x = self.random.randint(-1, width)
             elif side == 1:
                 # bottom
                 y = height
-                x = random.randint(-1, width)
+                x = self.random.randint(-1, width)
             elif side == 2:
                 # left
                 x = -1
-                y = random.randint(-1, height)
+                y = self.random.randint(-1, height)
             else:
                 x = width
-                y = random.randint(-1, height)
+                y = self.random.randint(-1, height)
             self.add_fox(self._choose_fox((x, y)))
 
     def fix_buildings(self):
@@ -1148,8 +1488,6 @@ class GameBoard(serializer.Simplifiable):
            Where partial buildings exist (i.e. places where the building
            cannot fit on the available tiles) the building is added anyway
            to the top left corner.
-
-           Could be a lot faster.
            """
         tile_to_building = dict((b.TILE_NO, b) for b in buildings.BUILDINGS)
 
@@ -1161,13 +1499,7 @@ class GameBoard(serializer.Simplifiable):
                 if tile_no not in tile_to_building:
                     continue
 
-                covered = False
-                for building in self.buildings:
-                    if building.covers(tile_pos):
-                        covered = True
-                        break
-
-                if covered:
+                if self.get_building(tile_pos) is not None:
                     continue
 
                 building_cls = tile_to_building[tile_no]
@@ -1176,9 +1508,19 @@ class GameBoard(serializer.Simplifiable):
                 building.place()
                 self.add_building(building)
 
+    def count_tiles(self, kind):
+        """Return the number of tiles of the named kind (e.g. 'woodland',
+           'fence') on the board."""
+        return self.tv.count_tiles(kind)
+
     def trees_left(self):
-        width, height = self.tv.size
-        return len([(x,y) for x in range(width) for y in range(height) if self.is_woodland_tile(misc.Position(x,y))])
+        return self.count_tiles('woodland')
+
+    def _tile_changed(self, tile_pos, old_tile, new_tile):
+        if self.night_log is not None:
+            self.night_log.tile(tile_pos, new_tile)
+        if 'woodland' in (tiles.TILE_MAP[old_tile], tiles.TILE_MAP[new_tile]):
+            self.calculate_wood_groat_exchange_rate()
 
     def calculate_wood_groat_exchange_rate(self):
         # per five planks
@@ -65,12 +65,9 @@ class Level(serializer.Simplifiable):
         for animal, _prob in DEFAULT_FOX_WEIGHTINGS:
             self.fox_weightings.append((animal, config.getint('Enemy probabilities', animal.CONFIG_NAME)))
 
-    @classmethod
-    def unsimplify(cls, *args, **kwargs):
-        """Override default Simplifiable unsimplification."""
-        obj = super(Level, cls).unsimplify(*args, **kwargs)
-        obj.__init__(obj.config_name)
-        return obj
+    def restored(self):
+        """Override default Simplifiable restoration."""
+        self.__init__(self.config_name)
 
     # Utility functions, so we can make things more flexible later
 
@@ -9,15 +9,29 @@ from pgu.algo import getline
 
 from . import serializer
 
+# Offsets of the 8-connected neighbours of a tile
+NEIGHBOUR_8 = ((-1, 0), (1, 0), (0, 1), (0, -1),
+        (1, 1), (1, -1), (-1, 1), (-1, -1))
+
 class Position(serializer.Simplifiable):
-    """2D/3D position / vector. Assumed immutable."""
+    """2D/3D position / vector. Immutable.
+
+       There are a lot of these about at night, so they're kept small and
+       their hash is worked out up front.
+       """
 
     SIMPLIFY = ['x', 'y', 'z']
 
+    __slots__ = ['x', 'y', 'z', '_hash']
+
     def __init__(self, x, y, z=0):
         self.x = x
         self.y = y
         self.z = z
+        self._hash = hash((x, y, z))
+
+    def restored(self):
+        self._hash = hash(self.to_3d_tuple())
 
     def to_tile_tuple(self):
         return self.x, self.y
@@ -36,6 +50,11 @@ class Position(serializer.Simplifiable):
     def __add__(self, b):
         return Position(self.x + b.x, self.y + b.y, self.z + b.z)
 
+    def neighbours(self):
+        """The 8-connected neighbours of this position, on the same level."""
+        x, y, z = self.x, self.y, self.z
+        return [Position(x + dx, y + dy, z) for dx, dy in NEIGHBOUR_8]
+
     def left_of(self, b):
         return self.x < b.x
 
@@ -43,10 +62,15 @@ class Position(serializer.Simplifiable):
         return self.x > b.x
 
     def __hash__(self):
-        return hash(self.to_3d_tuple())
+        return self._hash
 
     def __eq__(self, b):
-        return self.to_3d_tuple() == b.to_3d_tuple()
+        if self is b:
+            return True
+        if not isinstance(b, Position):
+            return NotImplemented
+        return self._hash == b._hash and self.x == b.x and self.y == b.y \
+                and self.z == b.z
 
     def __str__(self):
         return "<Position: %s>" % (self.to_3d_tuple(),)
@@ -74,8 +98,8 @@ class WeightedSelection(object):
                 self.weightings.append((item, weight))
                 self.total += weight
 
-    def choose(self):
-        roll = random.uniform(0, self.total)
+    def choose(self, rng=random):
+        roll = rng.uniform(0, self.total)
         for item, weight in self.weightings:
             if roll < weight:
                 return item
@@ -0,0 +1,294 @@
+"""Resolving a night in one go or on a worker thread, and showing
+   snapshots of what happened."""
+
+import threading
+
+from pgu.vid import Sprite
+
+from . import constants
+from . import sound
+from . import tiles
+
+# Sprite layers captured in each snapshot. Animations are recorded as
+# they start instead, and the cursor isn't part of the night.
+SNAPSHOT_LAYERS = ['buildings', 'animals']
+
+class NightStep(object):
+    """What the board looked like after one night step.
+
+       Snapshots are never changed once taken, so they can be kept and
+       handed around freely.
+       """
+
+    __slots__ = ['sprites', 'animations', 'sounds', 'counters', 'tiles']
+
+    def __init__(self, sprites, animations, sounds, counters, tiles=()):
+        # tuple of (layer, image, (x, y)) for each sprite, bottom first
+        self.sprites = sprites
+        # tuple of (animation class, args) started during the step
+        self.animations = animations
+        # tuple of sound file names played during the step
+        self.sounds = sounds
+        # (cash, chickens, eggs, killed foxes) for the toolbar
+        self.counters = counters
+        # tuple of ((x, y), tile number) for each tile changed, in order
+        self.tiles = tiles
+
+def take_snapshot(board, animations=(), sounds=(), tiles=()):
+    """Capture the positions and images of the board's sprites, and the
+       toolbar counters."""
+    tv = board.tv
+    sprites = []
+    for layer in SNAPSHOT_LAYERS:
+        for sprite in tv.sprites.in_layer(layer):
+            # Bring rect up to date with where the sprite really is
+            sprite.loop(tv, sprite)
+            sprites.append((layer, sprite.image,
+                (sprite.rect.x - sprite.shape.x, sprite.rect.y - sprite.shape.y)))
+    counters = (board.cash, len(board.chickens), board.eggs,
+            board.killed_foxes)
+    return NightStep(tuple(sprites), tuple(animations), tuple(sounds),
+            counters, tuple(tiles))
+
+def copy_tiles(board):
+    """Return a copy of the board's tile layer."""
+    return [list(row) for row in board.tv.tlayer]
+
+class NightLog(object):
+    """A step by step record of a night."""
+
+    def __init__(self):
+        self.steps = []
+        # the tile layer before the first step, if wanted for a replay
+        self.start_tiles = None
+        self._animations = []
+        self._sounds = []
+        self._tiles = []
+
+    def animation(self, animation, args):
+        self._animations.append((animation, args))
+
+    def sound(self, filename):
+        self._sounds.append(filename)
+
+    def tile(self, pos, tile):
+        self._tiles.append((tuple(pos), tile))
+
+    def end_step(self, board):
+        self.steps.append(take_snapshot(board, self._animations,
+            self._sounds, self._tiles))
+        self._animations = []
+        self._sounds = []
+        self._tiles = []
+
+def resolve_night(board, steps_taken=0, log=None):
+    """Run the rest of the night as fast as possible, with animations and
+       sounds turned off.
+
+       steps_taken is the number of night steps already run. If log is
+       given, a snapshot of each step is added to it.
+
+       Returns the number of night steps taken in all.
+       """
+    if log is not None and log.start_tiles is None:
+        log.start_tiles = copy_tiles(board)
+    board.show_effects = False
+    board.night_log = log
+    try:
+        while steps_taken < constants.NIGHT_LENGTH:
+            steps_taken += 1
+            over = board.do_night_step()
+            if log is not None:
+                log.end_step(board)
+            if over:
+                break
+    finally:
+        board.show_effects = True
+        board.night_log = None
+    return steps_taken
+
+class SnapshotView(object):
+    """Draws NightStep snapshots on the board's FarmVid.
+
+       Stand-in sprites are drawn where the snapshot says the buildings
+       and animals were, in place of the board's own sprites, and the
+       map is drawn from our own copy of the tiles, so the board can be
+       left alone while we draw.
+
+       start_tiles is the tile layer to start from, which is a copy of
+       the board's by default.
+       """
+
+    def __init__(self, board, start_tiles=None):
+        self.board = board
+        self.tv = board.tv
+        # Only the main thread looks at the display, so remember now
+        # whether there's a toolbar to keep up to date
+        self.toolbar = board.toolbar if board.disp else None
+        self.sprites = tiles.LayeredSprites(self.tv.sprites.layers,
+                self.tv.sprites.default_layer)
+        if start_tiles is None:
+            start_tiles = copy_tiles(board)
+        self.tiles = start_tiles
+        self._stand_ins = []
+        self._counters = None
+        self.tv.show_stand_ins(self.sprites, self.tiles)
+
+    def show(self, steps):
+        """Show the last of steps, with the animations and sounds from
+           all of them.
+
+           As when several steps run in one frame, each animation or sound
+           is only started once.
+           """
+        step = steps[-1]
+        sprites = self.sprites
+        while len(self._stand_ins) < len(step.sprites):
+            layer, image, pos = step.sprites[len(self._stand_ins)]
+            stand_in = Sprite(image, pos)
+            stand_in.layer = layer
+            sprites.append(stand_in, layer)
+            self._stand_ins.append(stand_in)
+        while len(self._stand_ins) > len(step.sprites):
+            stand_in = self._stand_ins.pop()
+            sprites.remove(stand_in, stand_in.layer)
+        for stand_in, (layer, image, pos) in zip(self._stand_ins, step.sprites):
+            if stand_in.layer != layer:
+                sprites.remove(stand_in, stand_in.layer)
+                sprites.append(stand_in, layer)
+                stand_in.layer = layer
+            if stand_in.image is not image:
+                stand_in.setimage(image)
+            stand_in.rect.topleft = pos
+        effects = set()
+        for shown in steps:
+            for (x, y), tile in shown.tiles:
+                if self.tiles[y][x] != tile:
+                    self.tiles[y][x] = tile
+                    self.tv.redraw_tile((x, y))
+            for effect in shown.animations:
+                if effect not in effects:
+                    effects.add(effect)
+                    animation, args = effect
+                    animation(self.tv, *args)
+            for filename in shown.sounds:
+                if filename not in effects:
+                    effects.add(filename)
+                    sound.play_sound(filename)
+        toolbar = self.toolbar
+        if toolbar is not None and step.counters != self._counters:
+            self._counters = step.counters
+            cash, chickens, eggs, killed_foxes = step.counters
+            toolbar.update_cash_counter(cash)
+            toolbar.update_chicken_counter(chickens)
+            toolbar.update_egg_counter(eggs)
+            toolbar.update_fox_counter(killed_foxes)
+
+    def finish(self):
+        """Go back to drawing the board's own sprites and tiles."""
+        self.tv.show_stand_ins(None)
+        self._stand_ins = []
+        if self.toolbar is not None:
+            self.board.redraw_counters()
+
+class NightReplay(object):
+    """Play back the steps of a NightLog on a board."""
+
+    def __init__(self, board, log):
+        self._steps = iter(log.steps)
+        self.view = SnapshotView(board, log.start_tiles)
+
+    def show_next(self):
+        """Show the next step. Returns False once there are none left."""
+        for step in self._steps:
+            self.view.show([step])
+            return True
+        return False
+
+    def finish(self):
+        self.view.finish()
+
+class NightWorker(object):
+    """Runs night steps on a background thread.
+
+       Steps are asked for with request_step(). After each step the
+       worker publishes a NightStep snapshot, which take_steps() hands
+       over to the main thread for drawing with a SnapshotView, since
+       the board's own sprites may be mid-step. The board is only touched
+       by the worker while it holds lock, so the main thread needs to
+       hold lock to do anything with the board while the worker runs.
+       """
+
+    def __init__(self, board, steps_taken=0):
+        self.board = board
+        self.steps_taken = steps_taken
+        self.lock = threading.Lock()
+        self.dawn = False
+        self.error = None
+        self._requests = []
+        self._wake = threading.Event()
+        self._steps = []
+        self._running = True
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def request_step(self):
+        self._requests.append(True)
+        self._wake.set()
+
+    def pending(self):
+        """The number of steps asked for that haven't been published."""
+        return len(self._requests)
+
+    def take_steps(self):
+        """Return the snapshots published since the last call, oldest
+           first, or raise the error that stopped the worker, once."""
+        steps = []
+        while self._steps:
+            steps.append(self._steps.pop(0))
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+        return steps
+
+    def stop(self):
+        """Stop the worker, once it has finished any step it's on."""
+        self._running = False
+        self._wake.set()
+        self._thread.join()
+
+    def _run(self):
+        while self._running:
+            self._wake.wait()
+            self._wake.clear()
+            while self._running and self._requests and not self.dawn:
+                try:
+                    self._step()
+                except Exception as e:
+                    self.error = e
+                    self._running = False
+                self._requests.pop()
+            if self.dawn:
+                # Nothing more to do, whatever we're asked
+                del self._requests[:]
+
+    def _step(self):
+        """Run a night step, and publish a snapshot of it."""
+        board = self.board
+        log = NightLog()
+        with self.lock:
+            board.night_log = log
+            try:
+                if self.steps_taken >= constants.NIGHT_LENGTH:
+                    over = True
+                else:
+                    self.steps_taken += 1
+                    # The toolbar and effects are left to the main thread
+                    over = board.do_night_step(headless=True)
+                log.end_step(board)
+            finally:
+                board.night_log = None
+        # Only once the snapshot's ready, so it's there to draw at dawn
+        self._steps.append(log.steps[0])
+        self.dawn = over
@@ -0,0 +1,196 @@
+"""Movement costs and shared distance fields for planning enemy
+   movement."""
+
+import heapq
+
+from . import tiles
+from .misc import Position, NEIGHBOUR_8
+
+
+UNREACHABLE = float('inf')
+
+
+class MovementCostGrid(object):
+    """Movement cost of every tile on the board for one costs table.
+
+       The grid is a flat list of cells, padded with two rings of
+       OUT_OF_BOUNDS tiles around the board: the inner ring is where
+       enemies arrive and leave, and the outer ring stops searches from
+       running off the edge without needing bounds checks.
+       """
+
+    OUT_OF_BOUNDS = 100
+    PADDING = 2
+
+    def __init__(self, tv, costs):
+        self.costs = costs
+        width, height = tv.size
+        self.stride = width + 2 * self.PADDING
+        self.rows = height + 2 * self.PADDING
+        self.cells = [self.OUT_OF_BOUNDS] * (self.stride * self.rows)
+        for x in range(width):
+            for y in range(height):
+                self.tile_changed((x, y), None, tv.get((x, y)))
+
+    def tile_changed(self, tile_pos, _old_tile, new_tile):
+        cost = self.costs.get(tiles.TILE_MAP[new_tile], self.OUT_OF_BOUNDS)
+        self.cells[self.index(tile_pos)] = cost
+
+    def index(self, tile_pos):
+        """Return the index of tile_pos in cells, or None if it's beyond
+           the padding."""
+        x, y = tile_pos[0] + self.PADDING, tile_pos[1] + self.PADDING
+        if 0 <= x < self.stride and 0 <= y < self.rows:
+            return y * self.stride + x
+        return None
+
+    def get(self, tile_pos):
+        i = self.index(tile_pos)
+        if i is None:
+            return self.OUT_OF_BOUNDS
+        return self.cells[i]
+
+
+class DistanceField(object):
+    """Cheapest cost of reaching the sources from every tile.
+
+       Covers the board plus the ring of tiles just outside it. Entering
+       a tile costs whatever the cost grid says it costs, so the sources
+       themselves have distance 0.
+       """
+
+    def __init__(self, grid, sources):
+        self.grid = grid
+        stride, rows = grid.stride, grid.rows
+        self._offsets = [dy * stride + dx for dx, dy in NEIGHBOUR_8]
+        self._dist = [UNREACHABLE] * len(grid.cells)
+        # Fence off the outer ring of padding; nothing improves on -1
+        for x in range(stride):
+            self._dist[x] = self._dist[(rows - 1) * stride + x] = -1
+        for y in range(rows):
+            self._dist[y * stride] = self._dist[y * stride + stride - 1] = -1
+        heap = []
+        for pos in sources:
+            i = grid.index(pos)
+            self._dist[i] = 0
+            heap.append((0, i))
+        self._spread(heap)
+
+    def _spread(self, heap):
+        """Run Dijkstra outwards from the (distance, index) pairs in heap."""
+        dists = self._dist
+        cells = self.grid.cells
+        offsets = self._offsets
+        heapq.heapify(heap)
+        while heap:
+            dist, i = heapq.heappop(heap)
+            if dist > dists[i]:
+                continue # already reached more cheaply
+            dist += cells[i]
+            for offset in offsets:
+                j = i + offset
+                if dist < dists[j]:
+                    dists[j] = dist
+                    heapq.heappush(heap, (dist, j))
+
+    def cost_lowered(self, tile_pos):
+        """Entering tile_pos got cheaper, so paths through it may be
+           shorter."""
+        i = self.grid.index(tile_pos)
+        self._spread([(self._dist[i], i)])
+
+    def downhill(self, pos):
+        """Return the neighbours of pos on the cheapest paths to the
+           sources."""
+        i = self.grid.index((pos.x, pos.y))
+        if i is None or self._dist[i] < 0:
+            # Wandered off the field, so head back towards the board
+            width = self.grid.stride - 2 * self.grid.PADDING
+            height = self.grid.rows - 2 * self.grid.PADDING
+            return [Position(min(max(pos.x, -1), width),
+                min(max(pos.y, -1), height), pos.z)]
+        dists = self._dist
+        cells = self.grid.cells
+        best, min_cost = [], UNREACHABLE
+        for (dx, dy), offset in zip(NEIGHBOUR_8, self._offsets):
+            j = i + offset
+            if dists[j] < 0:
+                continue
+            cost = dists[j] + cells[j]
+            if cost < min_cost:
+                best, min_cost = [(dx, dy)], cost
+            elif cost == min_cost:
+                best.append((dx, dy))
+        return [Position(pos.x + dx, pos.y + dy, pos.z) for dx, dy in best]
+
+
+class FlowFields(object):
+    """Distance fields shared between all the enemies on the board.
+
+       There is a field for each costs table and target tile, and one for
+       each edge of the board for enemies heading home. Fields are built
+       when first asked for, and brought up to date with any tile changes
+       at the start of the next step.
+       """
+
+    def __init__(self, gameboard):
+        self.gameboard = gameboard
+        self.clear()
+
+    def clear(self):
+        self._fields = {}
+        self._changes = []
+
+    def tile_changed(self, tile_pos, old_tile, new_tile):
+        self._changes.append((tuple(tile_pos), old_tile, new_tile))
+
+    def start_step(self):
+        """Apply the tile changes since the last step to the fields."""
+        for tile_pos, old_tile, new_tile in self._changes:
+            for key, field in list(self._fields.items()):
+                costs = field.grid.costs
+                old_cost = costs.get(tiles.TILE_MAP[old_tile],
+                        MovementCostGrid.OUT_OF_BOUNDS)
+                new_cost = costs.get(tiles.TILE_MAP[new_tile],
+                        MovementCostGrid.OUT_OF_BOUNDS)
+                if new_cost > old_cost:
+                    # Shortest paths may now go anywhere, so start again
+                    del self._fields[key]
+                elif new_cost < old_cost:
+                    field.cost_lowered(tile_pos)
+        self._changes = []
+
+    def _edge_sources(self, pos):
+        """The tiles just outside the board edge pos is on."""
+        width, height = self.gameboard.tv.size
+        if pos.x < 0:
+            return [(-1, y) for y in range(-1, height + 1)]
+        elif pos.x >= width:
+            return [(width, y) for y in range(-1, height + 1)]
+        elif pos.y < 0:
+            return [(x, -1) for x in range(-1, width + 1)]
+        elif pos.y >= height:
+            return [(x, height) for x in range(-1, width + 1)]
+        return None
+
+    def get(self, costs, target, to_edge=False):
+        """Return the field for reaching target with the given costs.
+
+           If to_edge is set and target is off the board, any tile on the
+           same edge of the board will do."""
+        sources = to_edge and self._edge_sources(target)
+        if sources:
+            key = (id(costs), 'edge', sources[0], sources[-1])
+        else:
+            sources = [target.to_tile_tuple()]
+            key = (id(costs), sources[0])
+        field = self._fields.get(key)
+        if field is None:
+            field = DistanceField(self.gameboard.cost_grid(costs), sources)
+            self._fields[key] = field
+        return field
+
+    def next_step(self, costs, pos, target, to_edge=False):
+        """Return the neighbours of pos that are on the cheapest paths
+           to target."""
+        return self.get(costs, target, to_edge).downhill(pos)
@@ -0,0 +1,194 @@
+"""Timing save games in the binary and XML formats.
+
+   Plays a game headless to get a farm to save, optionally adds more
+   chickens and buildings to it, then saves and restores it a number of
+   times in each format, and reports the time taken and the size of the
+   save game.
+   """
+
+import io
+import math
+import sys
+import time
+import datetime
+from optparse import OptionParser
+
+import pygame
+
+from . import animal
+from . import buildings
+from . import constants
+from . import equipment
+from . import savegame
+from . import serializer
+from . import simulate
+from . import tiles
+
+
+# name, writer, reader
+FORMATS = [
+    ('binary', savegame.write_binary_savegame, savegame.read_binary_savegame),
+    ('xml', savegame.write_xml_savegame, savegame.read_xml_savegame),
+]
+
+
+def grow_map(board, tiles_needed):
+    """Extend the board's map with grassland, if need be, so that it has
+       at least tiles_needed grassland tiles."""
+    tv = board.tv
+    grassland = tiles.REVERSE_TILE_MAP['grassland']
+    extra = tiles_needed - tv.count_tiles('grassland')
+    if extra <= 0:
+        return
+    old_w, old_h = tv.size
+    side = int(math.ceil(math.sqrt(old_w * old_h + extra)))
+    w, h = max(old_w, side), max(old_h, side)
+    old_tlayer = tv.tlayer
+    tv.resize((w, h))
+    for y, row in enumerate(tv.tlayer):
+        for x in range(w):
+            if x < old_w and y < old_h:
+                row[x] = old_tlayer[y][x]
+            else:
+                row[x] = grassland
+    # Too many changes to announce one by one
+    tv.map_version += 1
+    tv.recount_tiles()
+
+
+def build_farm(board, chickens, building_count):
+    """Add building_count buildings, of each kind in turn, and chickens
+       chickens to the board, growing the map to make room.
+
+       Half the chickens go in abodes while there's space, and every
+       third chicken gets a rifle."""
+    largest = max(w * h for w, h in
+            (cls.SIZE for cls in buildings.BUILDINGS))
+    # Room for every building to be the largest, with some to spare for
+    # buildings that don't fit snugly
+    grow_map(board, 2 * (largest * building_count + chickens))
+    grassland = tiles.REVERSE_TILE_MAP['grassland']
+    w, h = board.tv.size
+    spots = [(x, y) for y in range(h) for x in range(w)
+            if board.tv.get((x, y)) == grassland]
+    spots.reverse()
+
+    abodes = []
+    for i in range(building_count):
+        building_cls = buildings.BUILDINGS[i % len(buildings.BUILDINGS)]
+        while spots:
+            pos = spots.pop()
+            size_w, size_h = building_cls.SIZE
+            if (pos[0] + size_w > w or pos[1] + size_h > h
+                    or board.get_outside_chicken(pos)):
+                continue
+            building = building_cls(pos, board)
+            if building.place():
+                board.add_building(building)
+                if building.ABODE:
+                    abodes.append(building)
+                break
+
+    for i in range(chickens):
+        chicken_cls = board.random.choice([animal.Chicken, animal.Rooster])
+        if i % 3 == 0:
+            item = equipment.Rifle()
+        else:
+            item = None
+        while abodes and i % 2:
+            try:
+                chicken = chicken_cls(abodes[-1].pos, board)
+                abodes[-1].add_occupant(chicken)
+            except buildings.BuildingFullError:
+                abodes.pop()
+                continue
+            board.add_chicken(chicken)
+            chicken.set_pos(chicken.abode.get_pos())
+            break
+        else:
+            while spots:
+                pos = spots.pop()
+                if (board.tv.get(pos) == grassland
+                        and not board.get_outside_chicken(pos)):
+                    break
+            else:
+                raise RuntimeError("No room left on the farm.")
+            chicken = chicken_cls(pos, board)
+            board.add_chicken(chicken)
+        if item is not None:
+            chicken.equip(item)
+
+
+def time_format(board, snapshot, writer, reader, repeats):
+    """Save and restore board repeatedly with the given writer and reader.
+
+       Returns the size of the save game and the mean save and restore
+       times in seconds. Saving includes simplifying the board, and
+       restoring includes unsimplifying it."""
+    timestamp = datetime.datetime.now()
+    level_name = board.level.level_name
+    save_time, load_time = 0.0, 0.0
+    for _repeat in range(repeats):
+        save_file = io.BytesIO()
+        start = time.perf_counter()
+        writer(save_file, serializer.simplify(board), snapshot, level_name,
+                timestamp)
+        save_time += time.perf_counter() - start
+        save_file.seek(0)
+        start = time.perf_counter()
+        data = reader(save_file)[0]
+        serializer.unsimplify(data)
+        load_time += time.perf_counter() - start
+    size = len(save_file.getvalue())
+    return size, save_time / repeats, load_time / repeats
+
+
+def report(board, results, out=sys.stdout):
+    print("Level: %s  Day: %d  Map: %dx%d  Chickens: %d  Buildings: %d"
+        "  Fences and traps: %d" % (board.level.level_name, board.days,
+            board.tv.size[0], board.tv.size[1], len(board.chickens),
+            len(board.buildings), len(board.tile_structures)), file=out)
+    for name, (size, save_time, load_time) in results:
+        print("  %-8s %9d bytes  %9.3fms save  %9.3fms restore" % (
+            name, size, 1000.0 * save_time, 1000.0 * load_time), file=out)
+
+
+def parse_args(params):
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("-l", "--level", metavar="LEVEL", dest="level_name",
+                      default="last_stand", help="save a game of LEVEL")
+    parser.add_option("-n", "--nights", metavar="N", dest="nights",
+                      type="int", default=0,
+                      help="play N nights before saving")
+    parser.add_option("-c", "--chickens", metavar="N", dest="chickens",
+                      type="int", default=0,
+                      help="add N chickens to the farm before saving")
+    parser.add_option("-b", "--buildings", metavar="N", dest="buildings",
+                      type="int", default=0,
+                      help="add N buildings to the farm before saving")
+    parser.add_option("-r", "--repeats", metavar="N", dest="repeats",
+                      type="int", default=5,
+                      help="save and restore N times in each format")
+    parser.add_option("-s", "--seed", metavar="SEED", dest="seed",
+                      type="int", default=None, help="seed the game with SEED")
+    opts, _ = parser.parse_args(params)
+    return opts
+
+
+def main(params=None):
+    """Entry point for the save game benchmark script."""
+    opts = parse_args(sys.argv[1:] if params is None else params)
+    # Buildings render their occupant counts, so fonts are still needed
+    pygame.font.init()
+    board, _nights, _steps = simulate.run_game(opts.level_name,
+            simulate.PhaseTimer(), opts.nights, opts.seed)
+    build_farm(board, opts.chickens, opts.buildings)
+    board.reset_states()
+    # The same size as the snapshots the game takes
+    snapshot = pygame.Surface((constants.SCREEN[0] // 4,
+        constants.SCREEN[1] // 4))
+    results = []
+    for name, writer, reader in FORMATS:
+        results.append((name, time_format(board, snapshot, writer, reader,
+            opts.repeats)))
+    report(board, results)
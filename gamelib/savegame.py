@@ -1,11 +1,14 @@
 """Utilities and widgets for saving and restoring games."""
 
 import xmlrpc.client
+import xml.parsers.expat
 import os
 import io
 import base64
+import struct
 import zlib
 import datetime
+import random
 
 from pgu import gui
 import pygame
@@ -14,23 +17,184 @@ from pygame.locals import KEYDOWN, K_ESCAPE
 from . import config
 from . import version
 from . import gameboard
+from . import buildings
 from . import serializer
 from . import misc
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
 
+# Games are saved in a binary container: a header, then a zlib stream of
+# records, each a section tag followed by one encoded value. Games saved
+# as xmlrpc XML by older versions can still be read.
+SAVE_EXT = ".fox"
+XML_SAVE_EXT = ".xml"
+SAVE_MAGIC = b"FOXA"
+# incremement whenever a change breaks the container itself, rather than
+# the game data in it (see version.SAVE_GAME_VERSION)
+CONTAINER_VERSION = 1
+HEADER = struct.Struct(">4sHH")
+# compress and decompress this many bytes at a time
+CHUNK_SIZE = 64 * 1024
+# The reader keeps at least this many bytes decompressed ahead, enough for
+# a type code and any number up to 63 bits, while there are any left
+READ_AHEAD = 10
+
+META_SECTION = b"META"
+SNAPSHOT_SECTION = b"SNAP"
+BOARD_SECTION = b"BORD"
+END_SECTION = b"END "
+# The game board's attributes that have sections of their own. The rest
+# go in the board section.
+ATTRIBUTE_SECTIONS = [
+    (b"TILE", ['tv']),
+    (b"ANML", ['chickens', 'foxes', 'selected_chickens', 'stored_selections']),
+    (b"BLDG", ['buildings', 'tile_structure_table']),
+]
+
+# Type codes for values in the binary container
+NONE, TRUE, FALSE = b"N", b"T", b"F"
+INT, NEG_INT, FLOAT = b"I", b"J", b"D"
+STR, STR_REF, BYTES = b"S", b"R", b"B"
+LIST, TUPLE, DICT = b"L", b"U", b"M"
+# Type codes followed by a number: the value itself, or a length or count
+NUMBERED_TYPES = frozenset([INT, NEG_INT, STR, STR_REF, BYTES,
+    LIST, TUPLE, DICT])
+FLOAT_STRUCT = struct.Struct(">d")
+
+# GameBoard.SIMPLIFY in save game versions that had a different list
+LEGACY_BOARD_ATTRIBUTES = {
+    2: ['level', 'tv', 'max_foxes', 'selected_chickens', 'stored_selections',
+        'chickens', 'foxes', 'buildings', 'cash', 'wood', 'eggs', 'days',
+        'killed_foxes', 'day', 'night'],
+    3: ['level', 'tv', 'max_foxes', 'selected_chickens', 'stored_selections',
+        'chickens', 'foxes', 'buildings', 'cash', 'wood', 'eggs', 'days',
+        'killed_foxes', 'day', 'night', 'seed', 'random_state'],
+}
+
 def read_savegame(fullpath):
-    """Open a save game file."""
-    xml = zlib.decompress(open(fullpath, "rb").read()).decode('UTF-8')
-    params, methodname = xmlrpc.client.loads(xml)
+    """Open a save game file, in either the binary or XML format."""
+    with open(fullpath, "rb") as save_file:
+        is_binary = save_file.read(len(SAVE_MAGIC)) == SAVE_MAGIC
+        save_file.seek(0)
+        if is_binary:
+            return read_binary_savegame(save_file)
+        return read_xml_savegame(save_file)
+
+def write_savegame(fullpath, data, snapshot, level_name, timestamp):
+    """Write a save game file."""
+    with open(fullpath, "wb") as save_file:
+        write_binary_savegame(save_file, data, snapshot, level_name,
+                timestamp)
+
+def read_binary_savegame(save_file):
+    """Read a save game from a binary container."""
+    header = save_file.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise SaveGameError("Save game file is incomplete.")
+    magic, container_version, save_version = HEADER.unpack(header)
+    if magic != SAVE_MAGIC:
+        raise SaveGameError("File does not appear to be a "
+            "Fox Assault save game.")
+    if (container_version != CONTAINER_VERSION
+            or save_version not in version.READABLE_SAVE_GAME_VERSIONS):
+        raise SaveGameError("Incompatible save game version.")
+
+    reader = RecordReader(save_file)
+    sections = {}
+    try:
+        with serializer.paused_gc():
+            while True:
+                tag, value = reader.read_section()
+                if tag is None:
+                    break
+                # Sections we don't know about are read and left out
+                sections[tag] = value
+    except (zlib.error, IndexError, TypeError, UnicodeDecodeError):
+        raise SaveGameError("Save game file is corrupt.")
+
+    try:
+        board = sections[BOARD_SECTION]
+        attrs = dict(board['attributes'])
+        for tag, _names in ATTRIBUTE_SECTIONS:
+            attrs.update(sections[tag])
+        data = {
+            'class': board['class'],
+            'refid': board['refid'],
+            'attributes': [attrs[name] for name in board['names']],
+        }
+    except (KeyError, TypeError):
+        raise SaveGameError("Saved game board state incomplete.")
+    data = upgrade_savegame(data, save_version)
+
+    try:
+        snapshot = load_snapshot(sections[SNAPSHOT_SECTION])
+    except Exception as e:
+        snapshot = None
+
+    meta = sections.get(META_SECTION, {})
+    level_name = meta.get('level_name')
+
+    try:
+        timestamp = datetime.datetime.strptime(meta['timestamp'],
+                TIMESTAMP_FORMAT)
+    except Exception as e:
+        timestamp = None
+
+    return data, snapshot, level_name, timestamp
+
+def write_binary_savegame(save_file, data, snapshot, level_name, timestamp):
+    """Write a save game as a binary container.
+
+       data is the simplified game board. Its attributes are split across
+       the sections, and put back in order when the game is read.
+       """
+    save_file.write(HEADER.pack(SAVE_MAGIC, CONTAINER_VERSION,
+        version.SAVE_GAME_VERSION))
+    writer = RecordWriter(save_file)
+    writer.write_section(META_SECTION, {
+        'level_name': level_name,
+        'timestamp': timestamp.strftime(TIMESTAMP_FORMAT),
+    })
+    writer.write_section(SNAPSHOT_SECTION, save_snapshot(snapshot))
+
+    names = serializer.REGISTERED_CLASSES[data['class']].SIMPLIFY
+    attrs = dict(zip(names, data['attributes']))
+    in_sections = set()
+    for _tag, section_names in ATTRIBUTE_SECTIONS:
+        in_sections.update(section_names)
+    writer.write_section(BOARD_SECTION, {
+        'class': data['class'],
+        'refid': data['refid'],
+        'names': list(names),
+        'attributes': dict((name, attrs[name]) for name in names
+            if name not in in_sections),
+    })
+    with serializer.paused_gc():
+        for tag, section_names in ATTRIBUTE_SECTIONS:
+            writer.write_section(tag,
+                    dict((name, attrs[name]) for name in section_names))
+    writer.finish()
+
+def read_xml_savegame(save_file):
+    """Read a save game in the old xmlrpc XML format."""
+    try:
+        xml_data = zlib.decompress(save_file.read()).decode('UTF-8')
+        # Packed lists of ints come back as bytes, not xmlrpc Binary objects
+        params, methodname = xmlrpc.client.loads(xml_data,
+                use_builtin_types=True)
+    except zlib.error:
+        raise SaveGameError("File does not appear to be a "
+            "Fox Assault save game.")
+    except (xml.parsers.expat.ExpatError, UnicodeDecodeError):
+        raise SaveGameError("Save game file is corrupt.")
     if methodname != "foxassault":
         raise SaveGameError("File does not appear to be a "
             "Fox Assault save game.")
     save_version = params[0]
-    if save_version != version.SAVE_GAME_VERSION:
+    if save_version not in version.READABLE_SAVE_GAME_VERSIONS:
         raise SaveGameError("Incompatible save game version.")
 
-    data = params[1]
+    data = upgrade_savegame(params[1], save_version)
 
     try:
         snapshot = decode_snapshot(params[2])
@@ -49,28 +213,386 @@ def read_savegame(fullpath):
 
     return data, snapshot, level_name, timestamp
 
-def write_savegame(fullpath, data, snapshot, level_name, timestamp):
-    """Write a save game file."""
+def write_xml_savegame(save_file, data, snapshot, level_name, timestamp):
+    """Write a save game in the old xmlrpc XML format."""
     snapshot_data = encode_snapshot(snapshot)
     timestamp_str = timestamp.strftime(TIMESTAMP_FORMAT)
     params = (version.SAVE_GAME_VERSION, data, snapshot_data, level_name, timestamp_str)
     xml = xmlrpc.client.dumps(params, "foxassault")
-    open(fullpath, "wb").write(zlib.compress(xml.encode('UTF-8')))
+    save_file.write(zlib.compress(xml.encode('UTF-8')))
 
-def encode_snapshot(snapshot):
-    """Encode a snapshot."""
+def save_snapshot(snapshot):
+    """Return a snapshot as image file data."""
     snapshot_file = io.BytesIO()
     pygame.image.save(snapshot, snapshot_file)
-    data = snapshot_file.getvalue()
-    data = base64.standard_b64encode(data)
-    return data
+    return snapshot_file.getvalue()
+
+def load_snapshot(data):
+    """Load a snapshot from image file data."""
+    snapshot_file = io.BytesIO(data)
+    return pygame.image.load(snapshot_file, "snapshot.tga")
+
+def encode_snapshot(snapshot):
+    """Encode a snapshot."""
+    return base64.standard_b64encode(save_snapshot(snapshot))
 
 def decode_snapshot(data):
     """Decode a snapshot."""
-    data = base64.standard_b64decode(data.data)
-    snapshot_file = io.BytesIO(data)
-    snapshot = pygame.image.load(snapshot_file, "snapshot.tga")
-    return snapshot
+    return load_snapshot(base64.standard_b64decode(data))
+
+def upgrade_savegame(data, save_version):
+    """Bring simplified game board data from an older save game version
+       up to date, in place, so it can be unsimplified. Returns the
+       data."""
+    if save_version not in LEGACY_BOARD_ATTRIBUTES:
+        return data
+    try:
+        attrs = dict(zip(LEGACY_BOARD_ATTRIBUTES[save_version],
+            data['attributes']))
+        if save_version < 3:
+            # Before boards had their own random stream, so start one
+            seed = random.randint(0, gameboard.GameBoard.MAX_SEED)
+            rng_version, internal, _gauss = random.Random(seed).getstate()
+            attrs['seed'] = {'raw': seed}
+            attrs['random_state'] = {'raw': ' '.join(str(x)
+                for x in (rng_version,) + internal)}
+        # Before fences and traps were kept in the tile layer
+        attrs['tile_structure_table'] = _split_tile_structures(data,
+                attrs['buildings'])
+        data['attributes'] = [attrs[name]
+                for name in gameboard.GameBoard.SIMPLIFY]
+    except (KeyError, TypeError, ValueError, IndexError):
+        raise SaveGameError("Saved game board state invalid.")
+    return data
+
+def _split_tile_structures(data, buildings_value):
+    """Take the fences and traps out of an old simplified set of buildings,
+       and return a tile structure table for them."""
+    definitions = {}
+    for _container, _key, value in _legacy_values(data):
+        if type(value) is dict and 'refid' in value:
+            definitions[value['refid']] = value
+
+    # version 2 saved a set, and version 3 a dict used as an ordered set
+    is_set = 'set' in buildings_value
+    items = buildings_value['set' if is_set else 'dict']
+    table = []
+    dropped = []
+    kept = []
+    for item in items:
+        building = item if is_set else item[0]
+        name = building.get('class')
+        if name in buildings.TILE_STRUCTURES:
+            x, y = _legacy_plain_value(building['attributes'][0],
+                    definitions)
+            table.append({'tuple': [{'raw': name}, {'raw': x}, {'raw': y}]})
+            dropped.append(building)
+        else:
+            kept.append(item)
+    items[:] = kept
+
+    # Anything still referred to elsewhere that was first saved as part
+    # of a fence or trap is moved to the first place it's referred to
+    dropped_definitions = {}
+    for building in dropped:
+        for _container, _key, value in _legacy_values(building):
+            if type(value) is dict and 'refid' in value:
+                dropped_definitions[value['refid']] = value
+    for container, key, value in _legacy_values(data):
+        if dropped_definitions and type(value) is dict and 'byref' in value:
+            definition = dropped_definitions.pop(value['byref'], None)
+            if definition is not None:
+                container[key] = definition
+    return {'tuple': table}
+
+def _legacy_values(value):
+    """Yield (container, key, value) for value and everything in it, in
+       the order unsimplify meets them. The caller can replace
+       container[key] before the next item is taken, and the replacement
+       is walked instead."""
+    todo = [(None, None, value)]
+    while todo:
+        container, key, value = todo.pop()
+        yield container, key, value
+        if container is not None:
+            value = container[key]
+        if type(value) is not dict:
+            continue
+        if 'class' in value:
+            slots = [(value['attributes'], i)
+                    for i in range(len(value['attributes']))]
+        elif 'dict' in value:
+            slots = [(pair, i) for pair in value['dict'] for i in (0, 1)]
+        else:
+            for kind in ('list', 'set', 'tuple'):
+                if kind in value:
+                    slots = [(value[kind], i)
+                            for i in range(len(value[kind]))]
+                    break
+            else:
+                continue
+        for slot, i in reversed(slots):
+            todo.append((slot, i, slot[i]))
+
+def _legacy_plain_value(value, definitions):
+    """Return a tuple of raw values from old simplified data."""
+    if 'byref' in value:
+        value = definitions[value['byref']]
+    if 'raw' in value:
+        return value['raw']
+    return tuple(_legacy_plain_value(x, definitions) for x in value['tuple'])
+
+
+class RecordWriter(object):
+    """Writes sections of a binary save game through a compressor.
+
+       Values are encoded into a buffer, which is compressed and written
+       out whenever it fills up, so the whole file is never held in
+       memory. Strings are written out once, and referred to by number
+       after that.
+       """
+
+    def __init__(self, out_file):
+        self._file = out_file
+        self._compressor = zlib.compressobj()
+        self._buffer = bytearray()
+        # string -> number
+        self._strings = {}
+
+    def write_section(self, tag, value):
+        self._buffer += tag
+        self.write_value(value)
+
+    def finish(self):
+        """Write the end of the sections, and flush the compressor."""
+        self._buffer += END_SECTION
+        self._flush()
+        self._file.write(self._compressor.flush())
+
+    def _flush(self):
+        self._file.write(self._compressor.compress(bytes(self._buffer)))
+        del self._buffer[:]
+
+    def _write_uint(self, n):
+        buf = self._buffer
+        while n > 0x7f:
+            buf.append((n & 0x7f) | 0x80)
+            n >>= 7
+        buf.append(n)
+
+    def write_value(self, value):
+        buf = self._buffer
+        # Values still to write, last first
+        todo = [value]
+        while todo:
+            value = todo.pop()
+            kind = type(value)
+            if value is None:
+                buf += NONE
+            elif kind is bool:
+                buf += TRUE if value else FALSE
+            elif kind is int:
+                # Most numbers fit in a byte, so skip the call for those
+                if 0 <= value < 0x80:
+                    buf += INT
+                    buf.append(value)
+                elif value >= 0:
+                    buf += INT
+                    self._write_uint(value)
+                else:
+                    buf += NEG_INT
+                    self._write_uint(-value)
+            elif kind is float:
+                buf += FLOAT
+                buf += FLOAT_STRUCT.pack(value)
+            elif kind is str:
+                number = self._strings.get(value)
+                if number is None:
+                    self._strings[value] = len(self._strings)
+                    encoded = value.encode('UTF-8')
+                    buf += STR
+                    self._write_uint(len(encoded))
+                    buf += encoded
+                elif number < 0x80:
+                    buf += STR_REF
+                    buf.append(number)
+                else:
+                    buf += STR_REF
+                    self._write_uint(number)
+            elif kind is bytes:
+                buf += BYTES
+                self._write_uint(len(value))
+                buf += value
+            elif kind is list or kind is tuple:
+                buf += LIST if kind is list else TUPLE
+                if len(value) < 0x80:
+                    buf.append(len(value))
+                else:
+                    self._write_uint(len(value))
+                todo.extend(reversed(value))
+            elif kind is dict:
+                buf += DICT
+                if len(value) < 0x80:
+                    buf.append(len(value))
+                else:
+                    self._write_uint(len(value))
+                for key, item in reversed(list(value.items())):
+                    todo.append(item)
+                    todo.append(key)
+            else:
+                raise SaveGameError("Can't save values of type %s."
+                        % (kind.__name__,))
+            if len(buf) >= CHUNK_SIZE:
+                self._flush()
+
+class RecordReader(object):
+    """Reads sections of a binary save game through a decompressor, a
+       chunk of the file at a time."""
+
+    def __init__(self, in_file):
+        self._file = in_file
+        self._decompressor = zlib.decompressobj()
+        self._buffer = b""
+        self._pos = 0
+        # number -> string
+        self._strings = []
+
+    def read_section(self):
+        """Return the next (tag, value), or (None, None) at the end."""
+        tag = self._read(4)
+        if tag == END_SECTION:
+            self._read_to_end()
+            return None, None
+        return tag, self.read_value()
+
+    def _read_to_end(self):
+        """Make sure the compressed stream ends properly, so a file that's
+           been cut short, if only in its checksum, isn't taken as whole."""
+        while not self._decompressor.eof:
+            chunk = self._file.read(CHUNK_SIZE)
+            if not chunk:
+                raise SaveGameError("Save game file is incomplete.")
+            self._decompressor.decompress(chunk)
+
+    def _fill(self, size, required=True):
+        """Make sure there are at least size bytes in the buffer. If
+           required isn't set, the file may run out before then."""
+        while len(self._buffer) - self._pos < size:
+            chunk = self._file.read(CHUNK_SIZE)
+            if chunk:
+                data = self._decompressor.decompress(chunk)
+            else:
+                data = self._decompressor.flush()
+                if not data:
+                    if required:
+                        raise SaveGameError("Save game file is incomplete.")
+                    return
+            self._buffer = self._buffer[self._pos:] + data
+            self._pos = 0
+
+    def _read(self, size):
+        self._fill(size)
+        pos = self._pos
+        self._pos = pos + size
+        return self._buffer[pos:pos + size]
+
+    def _read_uint(self):
+        n = shift = 0
+        while True:
+            self._fill(1)
+            byte = self._buffer[self._pos]
+            self._pos += 1
+            n |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return n
+            shift += 7
+
+    def read_value(self):
+        # This is where restoring spends its time, so the buffer and our
+        # place in it are kept in locals, and put back in self._buffer and
+        # self._pos whenever we need more from the file
+        buf, pos = self._buffer, self._pos
+        strings = self._strings
+        # Containers being filled: [type code, items, items still to read]
+        filling = []
+        try:
+            while True:
+                if len(buf) - pos < READ_AHEAD:
+                    self._pos = pos
+                    self._fill(READ_AHEAD, required=False)
+                    buf, pos = self._buffer, self._pos
+                    if pos == len(buf):
+                        raise SaveGameError("Save game file is incomplete.")
+                kind = buf[pos:pos + 1]
+                pos += 1
+                if kind in NUMBERED_TYPES:
+                    n = buf[pos]
+                    if n < 0x80:
+                        pos += 1
+                    else:
+                        self._pos = pos
+                        n = self._read_uint()
+                        buf, pos = self._buffer, self._pos
+                    if kind == INT:
+                        value = n
+                    elif kind == STR_REF:
+                        if n >= len(strings):
+                            raise SaveGameError("Save game file is corrupt.")
+                        value = strings[n]
+                    elif kind == LIST or kind == TUPLE or kind == DICT:
+                        if kind == DICT:
+                            n *= 2
+                        if n:
+                            filling.append([kind, [], n])
+                            continue
+                        value = self._make_container(kind, [])
+                    elif kind == NEG_INT:
+                        value = -n
+                    else:
+                        if len(buf) - pos < n:
+                            self._pos = pos
+                            self._fill(n)
+                            buf, pos = self._buffer, self._pos
+                        value = buf[pos:pos + n]
+                        pos += n
+                        if kind == STR:
+                            value = value.decode('UTF-8')
+                            strings.append(value)
+                elif kind == NONE:
+                    value = None
+                elif kind == TRUE:
+                    value = True
+                elif kind == FALSE:
+                    value = False
+                elif kind == FLOAT:
+                    value = FLOAT_STRUCT.unpack_from(buf, pos)[0]
+                    pos += FLOAT_STRUCT.size
+                else:
+                    raise SaveGameError("Unknown value type %r in save game."
+                            % (kind,))
+                # Add the value to its container, and that to its container
+                # if it's full, and so on
+                while filling:
+                    container = filling[-1]
+                    container[1].append(value)
+                    container[2] -= 1
+                    if container[2]:
+                        break
+                    filling.pop()
+                    value = self._make_container(container[0], container[1])
+                else:
+                    self._pos = pos
+                    return value
+        except (IndexError, struct.error):
+            # A number or float cut short by the end of the file
+            raise SaveGameError("Save game file is incomplete.")
+
+    def _make_container(self, kind, items):
+        if kind == LIST:
+            return items
+        elif kind == TUPLE:
+            return tuple(items)
+        return dict(zip(items[::2], items[1::2]))
 
 
 class SaveGameError(Exception):
@@ -140,7 +662,7 @@ class BaseSaveRestoreDialog(gui.Dialog):
         """Return the fullpath of the select save game file or None."""
         if self.value is None:
             return None
-        return os.path.join(self.save_folder, self.value + ".xml")
+        return os.path.join(self.save_folder, self.value + SAVE_EXT)
 
     def _populate_save_games(self):
         """Read list of save games."""
@@ -149,7 +671,10 @@ class BaseSaveRestoreDialog(gui.Dialog):
             root, ext = os.path.splitext(filename)
             if not os.path.isfile(fullpath):
                 continue
-            if ext != ".xml":
+            if ext not in (SAVE_EXT, XML_SAVE_EXT):
+                continue
+            if ext == XML_SAVE_EXT and root in self.save_games:
+                # already saved again in the binary format
                 continue
             self.save_games[root] = (fullpath, None)
 
@@ -253,6 +778,12 @@ class RestoreDialog(BaseSaveRestoreDialog):
         BaseSaveRestoreDialog.__init__(self, "Load Game ...", "Load", allow_new=False)
         self.connect(gui.CHANGE, self._restore, restore_func)
 
+    def get_fullpath(self):
+        """Return the fullpath of the select save game file or None."""
+        if self.value is None:
+            return None
+        return self.save_games[self.value][0]
+
     def _restore(self, restore_func):
         filename = self.get_fullpath()
         if filename is None:
@@ -0,0 +1,71 @@
+"""Frame pacing for the main loop, and fixed timestep simulation."""
+
+import pygame
+
+# Never run more than this many simulation steps to catch up in one go,
+# so a long stall (dragging the window, say) doesn't freeze the screen
+# while the simulation races to catch up.
+MAX_CATCH_UP = 5
+
+class FrameScheduler(object):
+    """Keep the main loop at a steady frame rate.
+
+       Rather than sleeping a fixed time every frame, tick() sleeps for
+       whatever is left of the frame, so slow frames don't make the game
+       slower and fast frames don't burn CPU.
+       """
+
+    def __init__(self, fps, clock=pygame.time.get_ticks,
+            sleep=pygame.time.wait):
+        self.frame_time = 1000.0 / fps
+        self._clock = clock
+        self._sleep = sleep
+        self._frame_end = self._clock() + self.frame_time
+
+    def time_left(self):
+        """Milliseconds left in the current frame's budget."""
+        return self._frame_end - self._clock()
+
+    def tick(self):
+        """Wait for the end of the frame and start the next one."""
+        left = self.time_left()
+        if left >= 1:
+            self._sleep(int(left))
+            self._frame_end += self.frame_time
+        else:
+            # We're running behind, so don't try to make up the frames
+            self._frame_end = self._clock() + self.frame_time
+
+class FixedStep(object):
+    """Run simulation steps at a fixed interval of game time, no matter
+       how often we're asked."""
+
+    def __init__(self, step_time, clock=pygame.time.get_ticks):
+        self.step_time = step_time
+        self._clock = clock
+        self._last = self._clock()
+        self._owed = 0
+
+    def set_step_time(self, step_time):
+        self.step_time = step_time
+        self._owed = min(self._owed, step_time)
+
+    def reset(self):
+        """Forget any time that's passed, e.g. after a spell of not
+           being asked for steps, so there's no burst to catch up on."""
+        self._last = self._clock()
+        self._owed = 0
+
+    def steps(self):
+        """Yield once for each step that is due.
+
+           If the caller stops early, the steps it didn't take stay due
+           for next time.
+           """
+        now = self._clock()
+        self._owed = min(self._owed + now - self._last,
+                self.step_time * MAX_CATCH_UP)
+        self._last = now
+        while self._owed >= self.step_time:
+            self._owed -= self.step_time
+            yield
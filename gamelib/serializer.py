@@ -2,89 +2,310 @@
 Interface for converting objects to and from simple structures: lists, dicts,
 strings, integers and combinations there of. Used for sending objects over
 the communications API.
+
+Each Simplifiable class gets a plan, worked out the first time the class
+is seen, of how to read and restore its attributes. Object graphs are
+walked with an explicit stack rather than by recursion, so deep graphs
+don't hit Python's recursion limit.
+
+Strings, numbers and booleans are stored as they are. Everything else is
+stored as a dict with a key saying what it is:
+
+  { 'class': name, 'refid': n, 'attributes': [...] }  a Simplifiable
+  { 'list': [...], 'refid': n }                       likewise set, tuple
+  { 'dict': [[key, value], ...], 'refid': n }
+  { 'ints': packed, 'type': typecode, 'refid': n }    a list of ints
+  { 'byref': n }                                      an item seen before
+  { 'none': '' }
+
+Data simplified by older versions, with string refids and every value
+wrapped as { 'raw': value }, can still be unsimplified.
 """
 
+import gc
+import sys
+from array import array
+from contextlib import contextmanager
+from operator import attrgetter
+from xmlrpc.client import Binary
+
 REGISTERED_CLASSES = {}
 
-def simplify(item, refs=None):
+# class -> ClassPlan
+_PLANS = {}
+
+# Types that are stored as they are
+_RAW_TYPES = frozenset([str, int, float, bool])
+
+# Array typecodes to try, smallest first, when packing lists of ints
+_INT_TYPECODES = ['b', 'B', 'h', 'H', 'i', 'I', 'q']
+
+# Packed ints are stored little-endian, whatever this machine is
+_SWAP_BYTES = sys.byteorder != 'little'
+
+class ClassPlan(object):
+    """How to simplify and unsimplify instances of a Simplifiable class."""
+
+    __slots__ = ['name', 'attrs', 'get', 'make', 'restored']
+
+    def __init__(self, cls):
+        self.name = cls.__name__
+        self.attrs = tuple(cls.SIMPLIFY)
+        # get(obj) returns a tuple of the attribute values
+        if len(self.attrs) == 1:
+            getter = attrgetter(self.attrs[0])
+            self.get = lambda obj: (getter(obj),)
+        elif self.attrs:
+            self.get = attrgetter(*self.attrs)
+        else:
+            self.get = lambda obj: ()
+        self.make = cls.make
+        self.restored = cls.restored
+
+def plan_for(cls):
+    """Return the plan for cls, working it out if need be."""
+    plan = _PLANS.get(cls)
+    if plan is None:
+        plan = _PLANS[cls] = ClassPlan(cls)
+    return plan
+
+def pack_ints(item):
+    """Return item, a list of ints, as (typecode, bytes), or None if the
+       ints are too big to pack."""
+    for typecode in _INT_TYPECODES:
+        try:
+            packed = array(typecode, item)
+        except OverflowError:
+            continue
+        if _SWAP_BYTES:
+            packed.byteswap()
+        return typecode, packed.tobytes()
+    return None
+
+def unpack_ints(typecode, data):
+    """Reverse pack_ints."""
+    if isinstance(data, Binary):
+        # from xmlrpc.client.loads without use_builtin_types
+        data = data.data
+    packed = array(typecode)
+    packed.frombytes(data)
+    if _SWAP_BYTES:
+        packed.byteswap()
+    return packed.tolist()
+
+@contextmanager
+def paused_gc():
+    """Hold off the cyclic garbage collector. Walking a big game builds a
+       lot of containers, none of them garbage, and the collector would
+       otherwise keep stopping to look through them all."""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+def simplify(item):
     """Convert an item to a simple data structure."""
-    if refs is None:
-        refs = set()
-
-    refid = str(id(item))
-
-    if refid in refs:
-        return { 'byref': refid }
-
-    if issubclass(type(item), Simplifiable):
-        refs.add(refid)
-        value = item.simplify(refs)
-        value['refid'] = refid
-    elif type(item) is list:
-        refs.add(refid)
-        value = { 'list': [simplify(x, refs) for x in item] }
-        value['refid'] = refid
-    elif type(item) is set:
-        refs.add(refid)
-        value = { 'set': [simplify(x, refs) for x in item] }
-        value['refid'] = refid
-    elif type(item) is dict:
-        refs.add(refid)
-        value = { 'dict': [(simplify(k, refs), simplify(v, refs)) for k, v in list(item.items())] }
-        value['refid'] = refid
-    elif type(item) is tuple:
-        refs.add(refid)
-        value = { 'tuple': tuple([simplify(x, refs) for x in item]) }
-        value['refid'] = refid
-    elif item is None:
-        value = { 'none': '' }
-    else:
-        value = { 'raw': item }
-
-    return value
+    with paused_gc():
+        return _simplify(item)
+
+def _simplify(item):
+    # id(item) -> refid
+    refs = {}
+    # Items with refids, kept alive so their ids aren't reused by
+    # temporary items (from properties, say) while we're walking
+    seen = []
+    result = [None]
+    # (item, container, index): simplify item into container[index]
+    todo = [(item, result, 0)]
+    pop, push = todo.pop, todo.append
+    while todo:
+        item, container, index = pop()
+        kind = type(item)
+        if kind in _RAW_TYPES:
+            container[index] = item
+            continue
+        if item is None:
+            container[index] = { 'none': '' }
+            continue
+
+        refid = refs.get(id(item))
+        if refid is not None:
+            container[index] = { 'byref': refid }
+            continue
+        refid = refs[id(item)] = len(refs)
+        seen.append(item)
+
+        if kind is list:
+            packed = None
+            if item and all(type(x) is int for x in item):
+                packed = pack_ints(item)
+            if packed is not None:
+                container[index] = { 'ints': packed[1], 'type': packed[0],
+                        'refid': refid }
+                continue
+            children = list(item)
+            container[index] = { 'list': children, 'refid': refid }
+        elif kind is dict:
+            children = []
+            for key, value in item.items():
+                children.append([key, value])
+            container[index] = { 'dict': children, 'refid': refid }
+            # Keys before values, in order
+            for pair in reversed(children):
+                push((pair[1], pair, 1))
+                push((pair[0], pair, 0))
+            continue
+        elif kind is set:
+            children = list(item)
+            container[index] = { 'set': children, 'refid': refid }
+        elif kind is tuple:
+            children = list(item)
+            container[index] = { 'tuple': children, 'refid': refid }
+        elif isinstance(item, Simplifiable):
+            plan = plan_for(kind)
+            children = list(plan.get(item))
+            container[index] = { 'class': plan.name,
+                    'attributes': children, 'refid': refid }
+        else:
+            raise SimplifyError("Can't simplify %r." % (item,))
+
+        # Push them backwards so they're simplified in order, and refids
+        # are handed out in the same order unsimplify meets them
+        for i in range(len(children) - 1, -1, -1):
+            push((children[i], children, i))
+
+    return result[0]
 
 def unsimplify(value, refs=None):
     """Reverse the simplify process."""
+    with paused_gc():
+        return _unsimplify(value, refs)
+
+def _unsimplify(value, refs):
     if refs is None:
         refs = {}
+    result = [None]
+    # Tasks are either (value, target, key, None): unsimplify value and
+    # store it in target (a list, or an object's attribute); or
+    # (None, target, key, finish): finish(), then store the result.
+    # Values that aren't dicts are stored as they are, which is also how
+    # a container gets stored once its contents are done.
+    todo = [(value, result, 0, None)]
+    pop, push = todo.pop, todo.append
+    while todo:
+        value, target, key, finish = pop()
+        if finish is not None:
+            item = finish()
+        elif type(value) is not dict:
+            item = value
+        elif 'class' in value:
+            plan = plan_for(REGISTERED_CLASSES[value['class']])
+            attrs = value['attributes']
+            names = plan.attrs
+            if len(attrs) != len(names):
+                raise SimplifyError("Wrong number of attributes for this"
+                    " class (%r)" % (value['class'],))
+            item = plan.make()
+            refs[value['refid']] = item
+            # Attributes are set in order, so set the simple ones up to
+            # the first one that needs unsimplifying straight away
+            first = len(attrs)
+            for i, attr_value in enumerate(attrs):
+                if type(attr_value) is dict:
+                    first = i
+                    break
+                setattr(item, names[i], attr_value)
+            if first == len(attrs):
+                plan.restored(item)
+            else:
+                push((None, target, key, _restorer(item, plan)))
+                for i in range(len(attrs) - 1, first - 1, -1):
+                    push((attrs[i], item, names[i], None))
+                continue
+        elif 'ints' in value:
+            item = refs[value['refid']] = unpack_ints(value['type'],
+                    value['ints'])
+        elif 'list' in value:
+            item = refs[value['refid']] = list(value['list'])
+            if _push_contents(item, push, (item, target, key, None)):
+                # Stored once it's filled, in case target is a property
+                continue
+        elif 'dict' in value:
+            # Keys need to be finished before they can be hashed
+            pairs = [list(pair) for pair in value['dict']]
+            item = refs[value['refid']] = {}
+            push((None, target, key, _filler(item, dict.update, pairs)))
+            for pair in reversed(pairs):
+                _push_contents(pair, push)
+            continue
+        elif 'set' in value:
+            slots = list(value['set'])
+            item = refs[value['refid']] = set()
+            push((None, target, key, _filler(item, set.update, slots)))
+            _push_contents(slots, push)
+            continue
+        elif 'tuple' in value:
+            slots = list(value['tuple'])
+            push((None, target, key,
+                _tuple_maker(slots, refs, value.get('refid'))))
+            _push_contents(slots, push)
+            continue
+        elif 'none' in value:
+            item = None
+        elif 'raw' in value:
+            item = value['raw']
+        elif 'byref' in value:
+            refid = value['byref']
+            if refid in refs:
+                item = refs[refid]
+            else:
+                raise SimplifyError("Unknown refid %r in byref." % (refid,))
+        else:
+            raise SimplifyError("Unknown unsimplify type key.")
 
-    if 'refid' in value:
-        refid = value['refid']
-
-    if 'class' in value:
-        cls = REGISTERED_CLASSES[value['class']]
-        item = cls.unsimplify(value, refs)
-    elif 'list' in value:
-        item = []
-        refs[refid] = item
-        item.extend(unsimplify(x, refs) for x in value['list'])
-    elif 'set' in value:
-        item = set()
-        refs[refid] = item
-        item.update(unsimplify(x, refs) for x in value['set'])
-    elif 'dict' in value:
-        item = {}
-        refs[refid] = item
-        item.update(dict((unsimplify(k, refs), unsimplify(v, refs)) for k, v in value['dict']))
-    elif 'tuple' in value:
-        item = tuple([unsimplify(x, refs) for x in value['tuple']])
-    elif 'none' in value:
-        item = None
-    elif 'raw' in value:
-        item = value['raw']
-    elif 'byref' in value:
-        refid = value['byref']
-        if refid in refs:
-            item = refs[refid]
+        if type(target) is list:
+            target[key] = item
         else:
-            raise SimplifyError("Unknown refid %r in byref." % (refid,))
-    else:
-        raise SimplifyError("Unknown unsimplify type key.")
+            setattr(target, key, item)
+
+    return result[0]
 
-    if 'refid' in value:
-        refs[value['refid']] = item
+def _push_contents(slots, push, first=None):
+    """Push tasks to unsimplify the values in slots that need it, in
+       place, after pushing first if there are any. Returns True if
+       anything was pushed."""
+    pushed = False
+    for i in range(len(slots) - 1, -1, -1):
+        if type(slots[i]) is dict:
+            if not pushed:
+                pushed = True
+                if first is not None:
+                    push(first)
+            push((slots[i], slots, i, None))
+    return pushed
 
-    return item
+# Finish tasks for unsimplify
+
+def _restorer(obj, plan):
+    def finish():
+        plan.restored(obj)
+        return obj
+    return finish
+
+def _filler(item, fill, slots):
+    def finish():
+        fill(item, slots)
+        return item
+    return finish
+
+def _tuple_maker(slots, refs, refid):
+    def finish():
+        item = refs[refid] = tuple(slots)
+        return item
+    return finish
 
 class SimplifyError(Exception):
     pass
@@ -98,12 +319,15 @@ class Simplifiable(object, metaclass=SimplifiableMetaclass):
     """
     Object which can be simplified() and unsimplified() (i.e.
     converted to a data type which, for example, Python's XMLRPC
-    or json module is capable of handling). Each subclass
+    module is capable of handling). Each subclass
     must provide SIMPLIFY (a list of strings giving the names
     of attributes which should be stored) unless a parent class
     provides the right thing.
     """
 
+    # Sub-classes without __slots__ still get a __dict__
+    __slots__ = []
+
     # List of attributes which need to be stored and restored
     SIMPLIFY = []
 
@@ -114,6 +338,14 @@ class Simplifiable(object, metaclass=SimplifiableMetaclass):
         """
         return cls.__new__(cls)
 
+    def restored(self):
+        """
+        Called when the object has been unsimplified, once all its
+        attributes have been set. Sub-classes can override this to
+        rebuild anything that isn't stored.
+        """
+        pass
+
     @classmethod
     def unsimplify(cls, value, refs=None):
         """
@@ -121,38 +353,16 @@ class Simplifiable(object, metaclass=SimplifiableMetaclass):
         simplification.
         """
         actual_cls = REGISTERED_CLASSES[value['class']]
-        attrs = value['attributes']
-
         if not issubclass(actual_cls, cls):
             raise SimplifyError("Actual class (%r) not a subclass of"
                 " this class (%r)" % (actual_cls, cls))
+        return unsimplify(value, refs)
 
-        if not len(attrs) == len(actual_cls.SIMPLIFY):
-            raise SimplifyError("Wrong number of attributes for this"
-                " class (%r)" % (actual_cls,))
-
-        obj = actual_cls.make()
-        refs[value['refid']] = obj
-
-        for attr, value in zip(actual_cls.SIMPLIFY, attrs):
-            setattr(obj, attr, unsimplify(value, refs))
-
-        return obj
-
-    def simplify(self, refs=None):
+    def simplify(self):
         """
         Create a simplified version (tar) of the object.
         """
-        value = {}
-        value['class'] = self.__class__.__name__
-
-        attrs = []
-        for attr in self.SIMPLIFY:
-            o = getattr(self, attr)
-            attrs.append(simplify(o, refs))
-
-        value['attributes'] = attrs
-        return value
+        return simplify(self)
 
     def copy(self):
         """
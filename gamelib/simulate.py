@@ -0,0 +1,114 @@
+"""Headless batch simulation of whole games.
+
+   Runs the day / night cycle of a GameBoard without a display or gui,
+   for benchmarking, soak-testing and profiling the night simulation.
+   """
+
+import sys
+import time
+from optparse import OptionParser
+
+import pygame
+
+from . import level
+from . import gameboard
+from . import nightlog
+
+
+class PhaseTimer(object):
+    """Accumulates the wall time spent in each phase of the game."""
+
+    PHASES = ['start_day', 'start_night', 'night']
+
+    def __init__(self):
+        self.totals = dict((phase, 0.0) for phase in self.PHASES)
+        self.counts = dict((phase, 0) for phase in self.PHASES)
+
+    def run(self, phase, func, *args):
+        """Call func(*args), charging the time taken to phase."""
+        start = time.perf_counter()
+        result = func(*args)
+        self.totals[phase] += time.perf_counter() - start
+        self.counts[phase] += 1
+        return result
+
+    def total(self):
+        return sum(self.totals.values())
+
+
+def run_night(board):
+    """Step through a single night, as the NightState does when the
+       night is resolved.
+
+       Returns the number of night steps taken."""
+    return nightlog.resolve_night(board)
+
+
+def run_game(level_name, timer, max_nights=None, seed=None):
+    """Play a game of level_name through to the end (or max_nights).
+
+       Games with the same seed play out identically.
+
+       Returns the final gameboard, and the number of nights and steps
+       simulated."""
+    board = gameboard.GameBoard(None, level.Level(level_name), seed)
+    timer.run('start_day', board.start_day)
+    nights, steps = 0, 0
+    while max_nights is None or nights < max_nights:
+        board.reset_states()
+        timer.run('start_night', board.start_night)
+        steps += timer.run('night', run_night, board)
+        nights += 1
+        if board.level.is_game_over(board):
+            break
+        timer.run('start_day', board.start_day)
+    return board, nights, steps
+
+
+def report(timer, nights, steps, out=sys.stdout):
+    wall = timer.total()
+    print("Nights: %d  Steps: %d  Wall time: %.3fs" % (nights, steps, wall),
+            file=out)
+    if wall > 0:
+        print("Nights per second: %.2f  Steps per second: %.1f" % (
+            nights / wall, steps / wall), file=out)
+    for phase in timer.PHASES:
+        count = timer.counts[phase]
+        total = timer.totals[phase]
+        mean = 1000.0 * total / count if count else 0.0
+        print("  %-12s %5d calls  %9.3fs total  %9.3fms mean" % (
+            phase, count, total, mean), file=out)
+
+
+def parse_args(params):
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("-l", "--level", metavar="LEVEL", dest="level_name",
+                      default="two_weeks", help="simulate level LEVEL")
+    parser.add_option("-g", "--games", metavar="N", dest="games", type="int",
+                      default=1, help="play N games one after another")
+    parser.add_option("-n", "--nights", metavar="N", dest="nights", type="int",
+                      default=None, help="stop each game after N nights")
+    parser.add_option("-s", "--seed", metavar="SEED", dest="seed", type="int",
+                      default=None, help="seed the first game with SEED, and"
+                      " each later game with the next number up")
+    opts, _ = parser.parse_args(params)
+    return opts
+
+
+def main(params=None):
+    """Entry point for the batch simulation script."""
+    opts = parse_args(sys.argv[1:] if params is None else params)
+    # Buildings render their occupant counts, so fonts are still needed
+    pygame.font.init()
+    timer = PhaseTimer()
+    total_nights, total_steps = 0, 0
+    for game in range(opts.games):
+        seed = None if opts.seed is None else opts.seed + game
+        board, nights, steps = run_game(opts.level_name, timer, opts.nights,
+                seed)
+        total_nights += nights
+        total_steps += steps
+        print("Game %d (seed %d): %d days, %d chickens, %d foxes killed,"
+                " %d groats" % (game + 1, board.seed, board.days,
+                    len(board.chickens), board.killed_foxes, board.cash))
+    report(timer, total_nights, total_steps)
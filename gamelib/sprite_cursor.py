@@ -7,19 +7,18 @@ import pygame
 from pygame.locals import SRCALPHA
 
 from . import imagecache
+from . import fontcache
 from . import constants
 from pgu.vid import Sprite
 
-# ignore os.popen3 warning generated by pygame.font.SysFont
-import warnings
-warnings.filterwarnings("ignore", "os.popen3 is deprecated.")
+# font used for the cost
+COST_FONT = ('Vera', 20, True)
 
 class SpriteCursor(Sprite):
     """A Sprite used as an on-board cursor.
        """
 
     def __init__(self, image_name, tv, cost=None):
-        self._font = pygame.font.SysFont('Vera', 20, bold=True)
         image = imagecache.load_image(image_name, ["sprite_cursor"])
 
         if cost is not None:
@@ -32,7 +31,7 @@ class SpriteCursor(Sprite):
     def _apply_text(self, image, stext):
         """Apply the text to the image."""
         image = image.copy()
-        text = self._font.render(stext, True, constants.FG_COLOR)
+        text = fontcache.render(stext, constants.FG_COLOR, *COST_FONT)
         w, h = image.get_size()
         x, y = text.get_size()
         image.blit(text, (w - x, h - y))
@@ -46,7 +45,7 @@ class SmallSpriteCursor(SpriteCursor):
     """A sprite cursor for use with images too small for the associated text."""
 
     def _apply_text(self, image, stext):
-        text = self._font.render(stext, True, constants.FG_COLOR)
+        text = fontcache.render(stext, constants.FG_COLOR, *COST_FONT)
         w, h = image.get_size()
         x, y = text.get_size()
 
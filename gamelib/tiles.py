@@ -3,6 +3,8 @@
 import random
 import os
 
+import pygame
+
 from pgu import tilevid, vid
 from . import data
 from . import imagecache
@@ -50,10 +52,10 @@ class TileMap(object):
             if image_name == image:
                 yield n
 
-    def random_alternate(self, n):
+    def random_alternate(self, n, rng=random):
         alts = [a for a, (name, image) in list(self._alternate_tiles.items()) if name == self[n]]
         if alts:
-            return random.choice(alts)
+            return rng.choice(alts)
         return n
 
 TILE_MAP = TileMap()
@@ -73,35 +75,74 @@ class LayeredSprites(object):
         if default_layer is None:
             default_layer = layers[0]
         self.default_layer = default_layer
+        # Each layer is a dict of sprite -> None, used as an ordered set so
+        # adding and removing sprites is cheap without changing paint order.
         self._sprites = {}
         for layer in layers:
-            self._sprites[layer] = []
+            self._sprites[layer] = {}
+        # sprite -> layer it's in
+        self._layer_of = {}
+        # Removed sprites that still need their old position repainted.
+        # Nothing needs repainting until something has been drawn, so we
+        # only start tracking them once the vid has been painted.
+        self.track_removed = False
         self.removed = []
 
     def append(self, sprite, layer=None):
         if layer is None:
             layer = self.default_layer
-        self._sprites[layer].append(sprite)
+        old_layer = self._layer_of.get(sprite)
+        if old_layer is not None:
+            del self._sprites[old_layer][sprite]
+        self._sprites[layer][sprite] = None
+        self._layer_of[sprite] = layer
         sprite.updated = 1
 
     def remove(self, sprite, layer=None):
         if layer is None:
             layer = self.default_layer
-        self._sprites[layer].remove(sprite)
+        if self._layer_of.get(sprite) != layer:
+            raise ValueError('Sprite is not in layer %r.' % (layer,))
+        del self._sprites[layer][sprite]
+        del self._layer_of[sprite]
         sprite.updated = 1
-        self.removed.append(sprite)
+        if self.track_removed and sprite not in self._removed:
+            self._removed.add(sprite)
+            self._removed_list.append(sprite)
+
+    def _get_removed(self):
+        return self._removed_list
+
+    def _set_removed(self, removed):
+        # update() swaps in a fresh list once it has repainted
+        # where the old sprites were.
+        self._removed_list = removed
+        self._removed = set(removed)
+
+    removed = property(_get_removed, _set_removed)
+
+    def in_layer(self, layer):
+        """Return a list of the sprites in layer, bottom first."""
+        return list(self._sprites[layer])
+
+    def __contains__(self, sprite):
+        return sprite in self._layer_of
+
+    def __len__(self):
+        return len(self._layer_of)
 
     def __getitem__(self, key):
         # vid.py uses sprites[:] to get a mutation-safe list copy, so we need this.
         # No other indexing or slicing operations make sense.
         if not isinstance(key, slice):
             raise IndexError('[:] is the only supported slice/index operation.')
-        return iter(self)
+        return list(self)
 
     def __iter__(self):
-        # We iterate over all sprites in layer order.
+        # We iterate over all sprites in layer order. Each layer is copied
+        # first, since sprites may add or remove sprites as we go.
         for layer in self.layers:
-            for sprite in self._sprites[layer]:
+            for sprite in list(self._sprites[layer]):
                 yield sprite
 
 
@@ -122,32 +163,274 @@ class FarmVid(tilevid.Tilevid, serializer.Simplifiable):
     def __init__(self):
         tilevid.Tilevid.__init__(self)
         self.sprites = LayeredSprites(['buildings', 'animals', 'animations', 'cursor'], 'animals')
+        # functions called as listener(pos, old_tile, new_tile) on tile changes
+        self.tile_listeners = []
+        # bumped on every change to the map, so caches can tell they're stale
+        self.map_version = 0
+        # tile name -> number of tiles of that kind on the map
+        self._tile_counts = {}
+        # Tiles changed since the screen was last drawn, once anything has
+        # been drawn. Only list appends and pops touch this, so tiles can
+        # be changed from the night worker thread while we draw.
+        self._changed_tiles = []
+        self._painted = False
+        # set when everything needs repainting, e.g. at nightfall
+        self._repaint_all = True
+        # LayeredSprites drawn instead of sprites, e.g. to replay a night,
+        # and the tile layer drawn with them
+        self._stand_ins = None
+        self._stand_in_tiles = None
+        # sun_on -> the whole map drawn with the day or night tiles
+        self._backgrounds = {}
+        self._sun_on = True
 
     @classmethod
     def make(cls):
         """Override default Simplifiable object creation."""
         return cls()
 
-    @classmethod
-    def unsimplify(cls, *args, **kwargs):
-        """Override default Simplifiable unsimplification."""
-        obj = serializer.Simplifiable.unsimplify(*args, **kwargs)
+    def restored(self):
+        """Override default Simplifiable restoration."""
+        self.view.x, self.view.y = 0,0
+        self._view.x, self._view.y = 0,0
+        self.bounds = None
+        self.updates = []
+        self.recount_tiles()
+
+    def add_tile_listener(self, listener):
+        """Call listener(pos, old_tile, new_tile) whenever a tile changes."""
+        self.tile_listeners.append(listener)
+
+    def remove_tile_listener(self, listener):
+        self.tile_listeners.remove(listener)
+
+    def set(self, pos, v):
+        """Set a tile, telling any listeners if it changed."""
+        old = self.get(pos)
+        if old != v:
+            # Not Tilevid.set, which queues the tile for pgu's update()
+            self.tlayer[pos[1]][pos[0]] = v
+            if self._painted and self._stand_in_tiles is None:
+                self._changed_tiles.append(tuple(pos))
+            self.map_version += 1
+            self._tile_counts[TILE_MAP[old]] -= 1
+            new_kind = TILE_MAP[v]
+            self._tile_counts[new_kind] = self._tile_counts.get(new_kind, 0) + 1
+            for listener in self.tile_listeners:
+                listener(pos, old, v)
+
+    def recount_tiles(self):
+        """Count the tiles of each kind from scratch."""
+        self._tile_counts = {}
+        for row in self.tlayer:
+            for tile_no in row:
+                kind = TILE_MAP[tile_no]
+                self._tile_counts[kind] = self._tile_counts.get(kind, 0) + 1
+
+    def count_tiles(self, kind):
+        """Return the number of tiles of the named kind on the map."""
+        return self._tile_counts.get(kind, 0)
+
+    def _get_drawn_sprites(self):
+        if self._stand_ins is not None:
+            return self._stand_ins
+        return self.sprites
+
+    drawn_sprites = property(_get_drawn_sprites)
+
+    def show_stand_ins(self, stand_ins, tiles=None):
+        """Draw the stand_ins LayeredSprites instead of our own sprites,
+           until this is called again with None.
+
+           If tiles is given, it's drawn instead of tlayer, and changes to
+           it are shown with redraw_tile().
+           """
+        old_tiles = self._stand_in_tiles
+        if old_tiles is None:
+            old_tiles = self.tlayer
+        self._stand_ins = stand_ins
+        self._stand_in_tiles = tiles
+        if (self.tlayer if tiles is None else tiles) != old_tiles:
+            # The backgrounds show the wrong tiles now
+            self._backgrounds = {}
+            del self._changed_tiles[:]
+        self._repaint_all = True
+
+    def redraw_tile(self, pos):
+        """Show a change to the stand-in tiles at pos."""
+        if self._painted:
+            self._changed_tiles.append(tuple(pos))
+
+    def loop(self):
+        """Run the loop for the sprites being drawn."""
+        if self._stand_ins is None:
+            tilevid.Tilevid.loop(self)
+        else:
+            # Our own sprites may belong to another thread just now
+            for sprite in self._stand_ins[:]:
+                if hasattr(sprite, 'loop'):
+                    sprite.loop(self, sprite)
+
+    def _apply_tile_changes(self):
+        """Patch the backgrounds with the changed tiles, and return their
+           positions."""
+        changed = []
+        while self._changed_tiles:
+            pos = self._changed_tiles.pop()
+            for sun_on, background in self._backgrounds.items():
+                self._draw_tile(background, pos, sun_on)
+            changed.append(pos)
+        return changed
+
+    def paint(self, screen):
+        """Repaint everything, so no removed sprites are left to erase."""
+        self._painted = True
+        self._apply_tile_changes()
+        sprites = self.drawn_sprites
+        sw, sh = screen.get_width(), screen.get_height()
+        self.view.w, self.view.h = sw, sh
+        if self.bounds is not None:
+            self.view.clamp_ip(self.bounds)
+        ox, oy = self.view.x, self.view.y
+        screen.blit(self._background(), (0, 0), self.view)
+        for sprite in sprites:
+            sprite.irect.x = sprite.rect.x - sprite.shape.x
+            sprite.irect.y = sprite.rect.y - sprite.shape.y
+            screen.blit(sprite.image, (sprite.irect.x - ox, sprite.irect.y - oy))
+            sprite.updated = 0
+            sprite._irect = pygame.Rect(sprite.irect)
+            sprite._image = sprite.image
+        self.updates = []
+        self._view = pygame.Rect(self.view)
+        sprites.removed = []
+        sprites.track_removed = True
+        self._repaint_all = False
+        return [pygame.Rect(0, 0, sw, sh)]
+
+    def update(self, screen):
+        """Repaint just the parts of the screen that have changed.
+
+           Returns the list of screen rects that were repainted, which is
+           empty if nothing has moved.
+           """
+        sw, sh = screen.get_width(), screen.get_height()
+        self.view.w, self.view.h = sw, sh
+        if self.bounds is not None:
+            self.view.clamp_ip(self.bounds)
+        if self._repaint_all or self.view.topleft != self._view.topleft:
+            return self.paint(screen)
+
+        # Dirty areas, in map pixels
+        dirty = []
+        tw, th = self.tiles[0].image.get_width(), self.tiles[0].image.get_height()
+        for x, y in self._apply_tile_changes():
+            dirty.append(pygame.Rect(x * tw, y * th, tw, th))
+        sprites = self.drawn_sprites
+        for sprite in sprites.removed:
+            dirty.append(sprite._irect)
+        sprites.removed = []
+        for sprite in sprites:
+            irect = sprite.irect
+            irect.x = sprite.rect.x - sprite.shape.x
+            irect.y = sprite.rect.y - sprite.shape.y
+            if (sprite.updated or irect != sprite._irect
+                    or sprite.image is not sprite._image):
+                dirty.append(sprite._irect)
+                dirty.append(pygame.Rect(irect))
+                sprite.updated = 0
+                sprite._irect = pygame.Rect(irect)
+                sprite._image = sprite.image
+
+        updates = []
+        view_rect = pygame.Rect(self.view)
+        for rect in self._merge_rects(dirty):
+            rect = rect.clip(view_rect)
+            if rect.width and rect.height:
+                updates.append(self._repaint_area(screen, rect))
+        return updates
+
+    def _merge_rects(self, rects):
+        """Union overlapping rects, so no area is repainted twice."""
+        merged = []
+        for rect in rects:
+            rect = pygame.Rect(rect)
+            i = rect.collidelist(merged)
+            while i != -1:
+                rect.union_ip(merged.pop(i))
+                i = rect.collidelist(merged)
+            merged.append(rect)
+        return merged
+
+    def _repaint_area(self, screen, rect):
+        """Redraw the tiles and sprites in rect (in map pixels), and
+           return the area of the screen drawn on."""
+        ox, oy = self.view.x, self.view.y
+        screen_rect = rect.move(-ox, -oy)
+        old_clip = screen.get_clip()
+        screen.set_clip(screen_rect)
+        self._paint_tiles(screen, rect)
+        for sprite in self.drawn_sprites:
+            if sprite.irect.colliderect(rect):
+                screen.blit(sprite.image,
+                        (sprite.irect.x - ox, sprite.irect.y - oy))
+        screen.set_clip(old_clip)
+        return screen_rect
+
+    def _paint_tiles(self, screen, rect):
+        """Draw the tiles under rect (in map pixels)."""
+        screen.blit(self._background(), rect.move(-self.view.x, -self.view.y),
+                rect)
+
+    def _tile_image(self, tile_no, sun_on):
+        tile = self.tiles[tile_no]
+        if sun_on:
+            return getattr(tile, 'day_image', tile.image)
+        return getattr(tile, 'night_image', tile.image)
+
+    def _draw_tile(self, background, tile_pos, sun_on):
+        tw, th = self.tiles[0].image.get_width(), self.tiles[0].image.get_height()
+        x, y = tile_pos
+        if self.blayer is not None:
+            background.blit(self._tile_image(self.blayer[y][x], sun_on),
+                    (x * tw, y * th))
+        tlayer = self._stand_in_tiles
+        if tlayer is None:
+            tlayer = self.tlayer
+        background.blit(self._tile_image(tlayer[y][x], sun_on),
+                (x * tw, y * th))
 
-        obj.view.x, obj.view.y = 0,0
-        obj._view.x, obj._view.y = 0,0
-        obj.bounds = None
-        obj.updates = []
+    def _background(self):
+        """Return the map drawn with the current day or night tiles.
 
-        return obj
+           Each background is drawn in full the first time it's needed, and
+           kept up to date one tile at a time by set() after that.
+           """
+        background = self._backgrounds.get(self._sun_on)
+        if background is None:
+            w, h = self.size
+            tw, th = self.tiles[0].image.get_width(), self.tiles[0].image.get_height()
+            background = pygame.Surface((w * tw, h * th))
+            if pygame.display.get_surface() is not None:
+                background = background.convert()
+            for y in range(h):
+                for x in range(w):
+                    self._draw_tile(background, (x, y), self._sun_on)
+            self._backgrounds[self._sun_on] = background
+        return background
 
-    def tga_load_level(self, level_map):
+    def tga_load_level(self, level_map, rng=random):
         tilevid.Tilevid.tga_load_level(self, level_map)
+        self._backgrounds = {}
+        # Too many changes to announce one by one
+        self.map_version += 1
+        self.recount_tiles()
         for xy in [(x, y) for x in range(self.size[0]) for y in range(self.size[1])]:
-            self.set(xy, TILE_MAP.random_alternate(self.get(xy)))
+            self.set(xy, TILE_MAP.random_alternate(self.get(xy), rng))
 
     def png_folder_load_tiles(self, path):
         """Load tiles from a folder of PNG files."""
         full_path = data.filepath(path)
+        self._backgrounds = {}
         for dirpath, dirnames, filenames in os.walk(full_path):
             relative_path = dirpath[len(full_path):]
             relative_path = "/".join(relative_path.split(os.path.sep))
@@ -159,6 +442,8 @@ class FarmVid(tilevid.Tilevid, serializer.Simplifiable):
 
     def sun(self, sun_on):
         """Make it night."""
+        self._repaint_all = True
+        self._sun_on = sun_on
         for tile in self.tiles:
             if hasattr(tile, "sun"):
                 tile.sun(sun_on)
@@ -177,6 +177,8 @@ class BaseToolBar(gui.Table):
             ('Save selection', 'Ctrl & 0 .. 9'),
             ('        or', 'Alt & 0 .. 9'),
             ('Recall saved selection', '0 .. 9'),
+            ('Fast forward night', 'D'),
+            ('Resolve night at once', 'R'),
             ('Exit game', 'Esc'),
             ]
 
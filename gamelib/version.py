@@ -9,7 +9,9 @@ VERSION_STR = {
 }[VERSION[3]]
 
 # incremement whenever a change breaks the save game file format
-SAVE_GAME_VERSION = 2
+SAVE_GAME_VERSION = 5
+# save game versions we can still restore (see savegame.upgrade_savegame)
+READABLE_SAVE_GAME_VERSIONS = (2, 3, 4, 5)
 
 NAME = 'Operation Fox Assault'
 DESCRIPTION = 'Turn-based strategy game written using Pygame.'
@@ -0,0 +1,4 @@
+#! /usr/bin/env python
+
+from gamelib import simulate
+simulate.main()
@@ -0,0 +1,110 @@
+"""Tests for running nights on the worker thread."""
+
+import time
+import unittest
+
+import pygame
+
+from gamelib import constants, gameboard, level, nightlog
+
+SEED = 42
+
+
+def start_night(level_name, seed):
+    """Return a headless board at the start of its first night."""
+    board = gameboard.GameBoard(None, level.Level(level_name), seed)
+    board.start_day()
+    board.reset_states()
+    board.start_night()
+    return board
+
+
+def run_worker_night(board):
+    """Run a night on a NightWorker, asking for one step at a time, and
+       return the snapshots it published and the number of steps taken."""
+    worker = nightlog.NightWorker(board)
+    steps = []
+    try:
+        deadline = time.time() + 60
+        while not (worker.dawn and not worker.pending()):
+            if time.time() > deadline:
+                raise AssertionError("The night never ended.")
+            if not worker.pending():
+                worker.request_step()
+            steps.extend(worker.take_steps())
+            time.sleep(0.001)
+        steps.extend(worker.take_steps())
+    finally:
+        worker.stop()
+    return steps, worker.steps_taken
+
+
+def board_state(board):
+    return (board.killed_foxes, board.cash, board.eggs,
+            sorted(chicken.pos.to_3d_tuple() for chicken in board.chickens),
+            sorted(fox.pos.to_3d_tuple() for fox in board.foxes),
+            [list(row) for row in board.tv.tlayer])
+
+
+def step_state(step):
+    return (step.sprites, step.counters, step.tiles,
+            [(animation, args) for animation, args in step.animations],
+            step.sounds)
+
+
+class TestNightWorker(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        pygame.font.init()
+
+    def check_matches_resolve_night(self, level_name):
+        worker_board = start_night(level_name, SEED)
+        worker_steps, worker_taken = run_worker_night(worker_board)
+
+        board = start_night(level_name, SEED)
+        log = nightlog.NightLog()
+        taken = nightlog.resolve_night(board, 0, log)
+
+        self.assertEqual(worker_taken, taken)
+        self.assertEqual(board_state(worker_board), board_state(board))
+        # The worker publishes an extra snapshot for the step that finds
+        # the night already over at NIGHT_LENGTH
+        if taken == constants.NIGHT_LENGTH:
+            worker_steps = worker_steps[:len(log.steps)]
+        self.assertEqual([step_state(step) for step in worker_steps],
+                [step_state(step) for step in log.steps])
+
+    def test_matches_resolve_night(self):
+        # The foxes win on last_stand, but not on easy
+        self.check_matches_resolve_night('last_stand')
+        self.check_matches_resolve_night('easy')
+
+    def test_tiles_replay_to_end_of_night(self):
+        board = start_night('last_stand', SEED)
+        tiles = nightlog.copy_tiles(board)
+        steps, _taken = run_worker_night(board)
+        for step in steps:
+            for (x, y), tile in step.tiles:
+                tiles[y][x] = tile
+        self.assertEqual(tiles, board.tv.tlayer)
+
+    def test_error_raised_once(self):
+        board = start_night('last_stand', SEED)
+        worker = nightlog.NightWorker(board)
+        try:
+            def broken(headless=False):
+                raise ValueError("broken step")
+            board.do_night_step = broken
+            worker.request_step()
+            deadline = time.time() + 10
+            while worker.pending() and time.time() < deadline:
+                time.sleep(0.001)
+            self.assertRaises(ValueError, worker.take_steps)
+            self.assertEqual(worker.take_steps(), [])
+        finally:
+            worker.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,226 @@
+"""Tests for reading and writing save games."""
+
+import datetime
+import io
+import os
+import unittest
+import zlib
+
+import pygame
+
+from gamelib import gameboard, level, savegame, serializer, version
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+# The same game of the easy level, saved by each version of the format.
+# Version 2 and 3 saves are upgraded as they're read.
+SAVED_GAMES = ['easy-v3.xml', 'easy-v4.xml', 'easy-v4.fox', 'easy-v5.fox']
+
+# A different game, saved by the released version 2 code
+V2_SAVED_GAME = 'easy-v2.xml'
+
+TIMESTAMP = datetime.datetime(2026, 10, 18, 12, 0, 0)
+
+
+def data_path(name):
+    return os.path.join(DATA_DIR, name)
+
+
+def read_file(name):
+    with open(data_path(name), 'rb') as save_file:
+        return save_file.read()
+
+
+def board_state(board):
+    return (board.cash, board.wood, board.eggs, board.days,
+            board.killed_foxes, board.seed, board.random.getstate(),
+            [(type(chicken).__name__, chicken.pos.to_3d_tuple(),
+                [type(item).__name__ for item in chicken.equipment],
+                chicken.abode is not None) for chicken in board.chickens],
+            [(type(building).__name__, tuple(building.pos),
+                building.broken()) for building in board.buildings],
+            sorted((type(structure).__name__, pos, structure.broken())
+                for pos, structure in board.tile_structures.items()),
+            board.tv.tlayer)
+
+
+def restore(save_file):
+    data, snapshot, level_name, timestamp = \
+            savegame.read_binary_savegame(save_file)
+    return serializer.unsimplify(data)
+
+
+def write_records(sections):
+    out = io.BytesIO()
+    writer = savegame.RecordWriter(out)
+    for tag, value in sections:
+        writer.write_section(tag, value)
+    writer.finish()
+    return out.getvalue()
+
+
+def read_records(data):
+    reader = savegame.RecordReader(io.BytesIO(data))
+    sections = []
+    while True:
+        tag, value = reader.read_section()
+        if tag is None:
+            return sections
+        sections.append((tag, value))
+
+
+class TestRecords(unittest.TestCase):
+
+    def assertRoundTrips(self, value):
+        sections = [(b'TEST', value)]
+        self.assertEqual(read_records(write_records(sections)), sections)
+
+    def test_simple_values(self):
+        for value in [None, True, False, 0, 1, 127, 128, 2**70, -1, -2**70,
+                1.5, -0.25, '', 'fox', u'hén', b'', b'\x00\xff']:
+            self.assertRoundTrips(value)
+
+    def test_bools_stay_bools(self):
+        [(_tag, value)] = read_records(write_records([(b'TEST', [True, 1])]))
+        self.assertIs(value[0], True)
+        self.assertIs(type(value[1]), int)
+
+    def test_containers(self):
+        self.assertRoundTrips([])
+        self.assertRoundTrips(())
+        self.assertRoundTrips({})
+        self.assertRoundTrips([1, (2, 'three'), {'four': [5.0, None]}])
+        self.assertRoundTrips({(1, 2): 'tuple key', 3: ['int key']})
+
+    def test_repeated_strings(self):
+        value = ['fence', 'fence', {'fence': 'trap'}, 'trap', 'fence']
+        self.assertRoundTrips(value)
+        data = write_records([(b'TEST', value)])
+        self.assertEqual(zlib.decompress(data).count(b'fence'), 1)
+
+    def test_deep_nesting(self):
+        value = []
+        for _i in range(10000):
+            value = [value, 1]
+        [(_tag, read)] = read_records(write_records([(b'TEST', value)]))
+        depth = 0
+        while read:
+            read, one = read
+            self.assertEqual(one, 1)
+            depth += 1
+        self.assertEqual(depth, 10000)
+
+    def test_sections(self):
+        sections = [(b'AAAA', 1), (b'BBBB', [2]), (b'AAAA', 'three')]
+        self.assertEqual(read_records(write_records(sections)), sections)
+
+    def test_truncated(self):
+        data = write_records([(b'TEST', ['fox'] * 100 + list(range(1000)))])
+        for size in [0, 2, len(data) // 2, len(data) - 1]:
+            self.assertRaises(savegame.SaveGameError, read_records,
+                    data[:size])
+
+    def test_unknown_type(self):
+        data = zlib.compress(b'TEST' + b'?')
+        self.assertRaises(savegame.SaveGameError, read_records, data)
+
+
+class TestSaveGames(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        pygame.font.init()
+
+    def test_versions_load_alike(self):
+        expected = None
+        for name in SAVED_GAMES:
+            data, snapshot, level_name, timestamp = \
+                    savegame.read_savegame(data_path(name))
+            self.assertEqual(level_name, 'Very easy')
+            self.assertEqual(timestamp, TIMESTAMP)
+            self.assertEqual(snapshot.get_size(), (20, 15))
+            state = board_state(serializer.unsimplify(data))
+            if expected is None:
+                expected = state
+            else:
+                self.assertEqual(state, expected, name)
+
+    def test_version_2_upgraded(self):
+        data, _snapshot, _level_name, _timestamp = \
+                savegame.read_savegame(data_path(V2_SAVED_GAME))
+        board = serializer.unsimplify(data)
+        self.assertEqual((board.cash, board.wood, board.days), (2550, 541, 2))
+        self.assertEqual(len(board.chickens), 16)
+        self.assertEqual(sorted(type(building).__name__
+            for building in board.buildings), ['HenHouse'] * 3)
+        # Fences and traps are tile structures now
+        kinds = [type(structure).__name__
+                for structure in board.tile_structures.values()]
+        self.assertEqual(kinds.count('Fence'), 43)
+        self.assertEqual(kinds.count('Trap'), 2)
+        self.assertTrue(any(structure.broken()
+            for structure in board.tile_structures.values()))
+        self.assertTrue(0 <= board.seed <= gameboard.GameBoard.MAX_SEED)
+        # and it saves in the current format
+        out = io.BytesIO()
+        savegame.write_binary_savegame(out, board.save_game(),
+                pygame.Surface((8, 8)), 'Very easy', TIMESTAMP)
+        out.seek(0)
+        self.assertEqual(board_state(restore(out)), board_state(board))
+
+    def test_round_trip(self):
+        board = gameboard.GameBoard(None, level.Level('easy'), 11)
+        board.start_day()
+        for write, read in [
+                (savegame.write_binary_savegame,
+                    savegame.read_binary_savegame),
+                (savegame.write_xml_savegame, savegame.read_xml_savegame)]:
+            out = io.BytesIO()
+            write(out, board.save_game(), pygame.Surface((8, 8)), 'Easy',
+                    TIMESTAMP)
+            out.seek(0)
+            data, snapshot, level_name, timestamp = read(out)
+            self.assertEqual((level_name, timestamp), ('Easy', TIMESTAMP))
+            self.assertEqual(board_state(serializer.unsimplify(data)),
+                    board_state(board))
+
+    def test_truncated(self):
+        for name in ['easy-v5.fox', 'easy-v4.xml']:
+            data = read_file(name)
+            for size in [0, 6, len(data) // 2, len(data) - 1]:
+                self.assertRaises(savegame.SaveGameError,
+                        savegame.read_binary_savegame
+                            if name.endswith('.fox')
+                            else savegame.read_xml_savegame,
+                        io.BytesIO(data[:size]))
+
+    def test_corrupt(self):
+        data = bytearray(read_file('easy-v5.fox'))
+        middle = len(data) // 2
+        data[middle:middle + 8] = b'\xff' * 8
+        self.assertRaises(savegame.SaveGameError,
+                savegame.read_binary_savegame, io.BytesIO(bytes(data)))
+        # A string reference to a string that was never written
+        data = (savegame.HEADER.pack(savegame.SAVE_MAGIC,
+            savegame.CONTAINER_VERSION, version.SAVE_GAME_VERSION)
+            + zlib.compress(b'META' + savegame.STR_REF + b'\x05'))
+        self.assertRaises(savegame.SaveGameError,
+                savegame.read_binary_savegame, io.BytesIO(data))
+
+    def test_not_a_save_game(self):
+        self.assertRaises(savegame.SaveGameError,
+                savegame.read_xml_savegame, io.BytesIO(b'not a save game'))
+        data = savegame.HEADER.pack(b'FOXB', savegame.CONTAINER_VERSION,
+                version.SAVE_GAME_VERSION)
+        self.assertRaises(savegame.SaveGameError,
+                savegame.read_binary_savegame, io.BytesIO(data))
+
+    def test_future_version(self):
+        data = savegame.HEADER.pack(savegame.SAVE_MAGIC,
+                savegame.CONTAINER_VERSION, version.SAVE_GAME_VERSION + 1)
+        self.assertRaises(savegame.SaveGameError,
+                savegame.read_binary_savegame, io.BytesIO(data))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+"""Tests for simplifying and unsimplifying object graphs."""
+
+import unittest
+import xmlrpc.client
+
+from gamelib import serializer
+
+
+class SerializerTestNode(serializer.Simplifiable):
+    SIMPLIFY = ['value', 'next']
+
+    def __init__(self, value=None, next=None):
+        self.value = value
+        self.next = next
+
+
+class SerializerTestRestored(serializer.Simplifiable):
+    SIMPLIFY = ['items']
+
+    def restored(self):
+        self.total = sum(self.items)
+
+
+def round_trip(item):
+    return serializer.unsimplify(serializer.simplify(item))
+
+
+def xml_round_trip(item):
+    """Round trip through xmlrpc, as the XML save games do."""
+    xml = xmlrpc.client.dumps((serializer.simplify(item),), 'test')
+    params, _method = xmlrpc.client.loads(xml, use_builtin_types=True)
+    return serializer.unsimplify(params[0])
+
+
+class TestSerializer(unittest.TestCase):
+
+    def test_simple_values(self):
+        for value in [None, True, False, 0, -3, 2**70, 1.5, '', 'fox',
+                [], {}, (), set(), [None, 'a', 1.0]]:
+            self.assertEqual(round_trip(value), value)
+
+    def test_shared_references(self):
+        shared = [1, 2, 3]
+        node = SerializerTestNode(shared)
+        item = {'a': shared, 'b': shared, 'nodes': [node, node]}
+        for trip in (round_trip, xml_round_trip):
+            result = trip(item)
+            self.assertEqual(result['a'], shared)
+            self.assertIs(result['a'], result['b'])
+            self.assertIs(result['nodes'][0], result['nodes'][1])
+            self.assertIs(result['nodes'][0].value, result['a'])
+
+    def test_cycles(self):
+        first = SerializerTestNode('first')
+        second = SerializerTestNode('second', first)
+        first.next = second
+        result = round_trip(first)
+        self.assertEqual(result.value, 'first')
+        self.assertEqual(result.next.value, 'second')
+        self.assertIs(result.next.next, result)
+
+    def test_tuple_dict_keys(self):
+        item = {(1, 2): 'a', (3, (4, 5)): ['b'], 'plain': (6, 7)}
+        for trip in (round_trip, xml_round_trip):
+            result = trip(item)
+            self.assertEqual(result, item)
+            self.assertIs(type(result['plain']), tuple)
+
+    def test_shared_tuples(self):
+        pos = (3, 4)
+        result = round_trip([pos, {pos: pos}])
+        self.assertEqual(result, [pos, {pos: pos}])
+        self.assertIs(result[0], result[1][pos])
+
+    def test_packed_ints(self):
+        for ints in [[0, 1, 127], [-128, 5], [255, 0], [-1, 40000],
+                [2**31, 0], [-2**63, 2**63 - 1], list(range(1000))]:
+            data = serializer.simplify(ints)
+            self.assertIn('ints', data, ints)
+            self.assertEqual(round_trip(ints), ints)
+            self.assertEqual(xml_round_trip(ints), ints)
+
+    def test_packed_typecodes(self):
+        for ints, typecode in [([1, -1], 'b'), ([200], 'B'),
+                ([-200], 'h'), ([60000], 'H'), ([-70000], 'i'),
+                ([2**32 - 1], 'I'), ([2**40], 'q')]:
+            self.assertEqual(serializer.simplify(ints)['type'], typecode)
+
+    def test_unpackable_ints(self):
+        # Too big for any array typecode, so stored one by one
+        for ints in [[2**63], [0, 2**64 + 1], [-2**63 - 1, 1]]:
+            data = serializer.simplify(ints)
+            self.assertNotIn('ints', data)
+            self.assertEqual(round_trip(ints), ints)
+        # bools are ints, but aren't packed as them
+        self.assertEqual(round_trip([True, 1, False]), [True, 1, False])
+        self.assertIs(round_trip([True, 1])[0], True)
+
+    def test_packed_lists_shared(self):
+        row = [1, 2, 3]
+        result = round_trip([row, row])
+        self.assertIs(result[0], result[1])
+
+    def test_deep_graph(self):
+        depth = 50000
+        head = None
+        for i in range(depth):
+            head = SerializerTestNode(i, head)
+        nested = []
+        for _i in range(depth):
+            nested = [nested]
+        result, result_nested = round_trip([head, nested])
+        count = 0
+        while result is not None:
+            count += 1
+            self.assertEqual(result.value, depth - count)
+            result = result.next
+        self.assertEqual(count, depth)
+        count = 0
+        while result_nested:
+            (result_nested,) = result_nested
+            count += 1
+        self.assertEqual(count, depth)
+
+    def test_restored_hook(self):
+        item = SerializerTestRestored()
+        item.items = [1, 2, 3]
+        self.assertFalse(hasattr(item, 'total'))
+        # Called once the items are unsimplified, even when packed
+        self.assertEqual(round_trip(item).total, 6)
+        item.items = [1, 2 ** 64]
+        self.assertEqual(round_trip([item])[0].total, 2 ** 64 + 1)
+
+    def test_legacy_data(self):
+        # As simplified by the old serializer: string refids, and every
+        # value wrapped as {'raw': value}
+        shared_list = {'list': [{'raw': 1}, {'raw': 2}], 'refid': '1001'}
+        node = {
+            'class': 'SerializerTestNode',
+            'attributes': [shared_list, {'none': ''}],
+            'refid': '1002',
+        }
+        data = {
+            'dict': [
+                [{'raw': 'node'}, node],
+                [{'raw': 'again'}, {'byref': '1002'}],
+                [{'raw': 'list'}, {'byref': '1001'}],
+                [{'tuple': [{'raw': 1}, {'raw': 2}], 'refid': '1003'},
+                    {'set': [{'raw': 'a'}], 'refid': '1004'}],
+            ],
+            'refid': '1000',
+        }
+        result = serializer.unsimplify(data)
+        self.assertEqual(result['node'].value, [1, 2])
+        self.assertIsNone(result['node'].next)
+        self.assertIs(result['again'], result['node'])
+        self.assertIs(result['list'], result['node'].value)
+        self.assertEqual(result[(1, 2)], {'a'})
+
+    def test_unknown_reference(self):
+        self.assertRaises(serializer.SimplifyError, serializer.unsimplify,
+                {'list': [{'byref': 99}], 'refid': 0})
+
+    def test_wrong_attribute_count(self):
+        self.assertRaises(serializer.SimplifyError, serializer.unsimplify,
+                {'class': 'SerializerTestNode', 'attributes': [1],
+                    'refid': 0})
+
+    def test_unsimplifiable(self):
+        self.assertRaises(serializer.SimplifyError, serializer.simplify,
+                [object()])
+
+
+if __name__ == '__main__':
+    unittest.main()